@@ -0,0 +1,70 @@
+"""
+Measure the CPU cost of compressing the list responses against the bytes it saves.
+
+    python benchmarks/compression_bench.py --products 100000
+
+Seeds a database, takes the uncompressed bodies of the list endpoints and, for
+every encoding and level, reports the compression time, the size and the
+bytes saved per millisecond of CPU. Brotli is measured when it is installed.
+"""
+import argparse
+import gzip
+import os
+import tempfile
+import time
+from seed import DEFAULT_VOLUMES, seed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PATHS = ("/products?limit=20", "/products?limit=100", "/stores", "/categories", "/stores/1/products")
+
+
+def codecs():
+    """ Return (name, compress function) of every encoding and level to measure """
+    measured = [(f"gzip-{level}", lambda data, level=level: gzip.compress(data, compresslevel=level, mtime=0)) for level in (1, 6, 9)]
+    if brotli is not None:
+        measured += [(f"br-{quality}", lambda data, quality=quality: brotli.compress(data, quality=quality)) for quality in (1, 4, 11)]
+    return measured
+
+def time_compression(compress, data, repeat):
+    """ Return the fastest time of repeat compressions, and the compressed size """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = compress(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(compressed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    for volume, default in DEFAULT_VOLUMES.items():
+        parser.add_argument(f"--{volume.replace('_', '-')}", type=int, default=default)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DB_CONNECTION_STRING"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "compression.sqlite")
+    from main import app
+
+    with app.app_context():
+        seed({volume: getattr(args, volume) for volume in DEFAULT_VOLUMES})
+    client = app.test_client()
+    if brotli is None:
+        print("brotli is not installed, only gzip is measured")
+
+    print(f"{'path':22} {'encoding':9} {'bytes':>10} {'compressed':>11} {'saved':>7} {'cpu ms':>9} {'KB saved/ms':>12}")
+    for path in PATHS:
+        data = client.get(path).get_data()
+        for name, compress in codecs():
+            seconds, size = time_compression(compress, data, args.repeat)
+            saved = len(data) - size
+            print(f"{path:22} {name:9} {len(data):>10} {size:>11} {saved / len(data):>7.1%} "
+                  f"{seconds * 1000:>9.3f} {saved / 1024 / (seconds * 1000):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
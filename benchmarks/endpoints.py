@@ -0,0 +1,283 @@
+"""
+Benchmark every endpoint of src/main.py on a seeded database.
+
+    python benchmarks/endpoints.py --products 100000 --requests 200 --output results/$(git rev-parse --short HEAD).json
+    python benchmarks/endpoints.py --compare results/abc123.json
+
+Seeds a new SQLite file (or an empty database given with --database-url), drives
+every route through the Flask test client and reports, per endpoint, the
+throughput, the p50/p95/p99 latency and the SQL statements per request.
+The results are saved as JSON, --compare prints the change against a previous run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from seed import DEFAULT_VOLUMES, seed
+
+
+def percentile(sorted_values, fraction):
+    """ Nearest rank percentile of an already sorted list """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def scenarios(app, counts):
+    """ Return name -> (method, rule, request builder, optional untimed setup).
+        The builders take the request number and return (path, keyword arguments of the test client).
+    """
+    from flask_jwt_extended import create_access_token
+    from models import ProductToBuy
+    sellers, buyers, products, cart_rows = counts["sellers"], counts["buyers"], counts["products"], counts["cart_rows"]
+    run = str(int(time.time()))
+
+    def buyer(i):
+        return i % buyers + 1
+
+    tokens = {}
+
+    def token(user_id):
+        """ A token of the user, created once outside the timed requests """
+        if user_id not in tokens:
+            with app.app_context():
+                tokens[user_id] = create_access_token(identity=str(user_id))
+        return tokens[user_id]
+
+    def as_user(user_id, **kwargs):
+        """ Keyword arguments of the test client with the Authorization header of the user """
+        return {"headers": {"Authorization": f"Bearer {token(user_id)}"}, **kwargs}
+
+    # The seed gives the user id of seller n (and of its store n) to n, and sellers + n to buyer n
+    def as_seller(store_id, **kwargs):
+        return as_user(store_id, **kwargs)
+
+    def as_buyer(buyer_id, **kwargs):
+        return as_user(sellers + buyer_id, **kwargs)
+
+    def as_owner(cart_row, **kwargs):
+        """ As the buyer of the cart row """
+        with app.app_context():
+            buyer_id = ProductToBuy.query.with_entities(ProductToBuy.buyer_id).filter_by(id = cart_row).scalar()
+        return as_buyer(buyer_id or 1, **kwargs)
+
+    logouts = {}
+
+    def fresh_token(client, i):
+        """ Untimed setup of the logouts, every one revokes a new token """
+        with app.app_context():
+            logouts[i] = create_access_token(identity=str(sellers + buyer(i)))
+
+    etags = {}
+
+    def fetch_etag(client, path):
+        """ Untimed setup of the conditional requests, the ETag of the current version of path """
+        if path not in etags:
+            etags[path] = client.get(path).headers["ETag"]
+
+    def csv_upload(i):
+        rows = "".join(f"imported {i} {n},bench import,9.99,10,true,https://img.bench.test/i.png,1\n" for n in range(100))
+        return {
+            "data": "name,description,price,amount_available,active,img_url,category_id\n" + rows,
+            "content_type": "text/csv"
+        }
+
+    return {
+        "metrics": ("GET", "/metrics", lambda i: ("/metrics", {}), None),
+        "cache_stats": ("GET", "/cache/stats", lambda i: ("/cache/stats", {}), None),
+        "signup_buyer": ("POST", "/signup-buyer", lambda i: ("/signup-buyer", {"json": {
+            "email": f"new-buyer-{run}-{i}@bench.test", "password": "password", "first_name": "New",
+            "last_name": "Buyer", "id_number": f"B{run[-6:]}{i}", "cellphone_number": "300", "address": "Calle 2"
+        }}), None),
+        "signup_seller": ("POST", "/signup-seller", lambda i: ("/signup-seller", {"json": {
+            "email": f"new-seller-{run}-{i}@bench.test", "password": "password", "company_name": f"New {run} {i}",
+            "identification_number": f"NEW{run}{i}", "cellphone_number": "300",
+            "name": f"New store {run} {i}", "description": "bench"
+        }}), None),
+        "login": ("POST", "/login", lambda i: ("/login", {"json": {
+            "email": f"user{i % counts['users'] + 1}@bench.test", "password": "password"
+        }}), None),
+        "logout": ("POST", "/logout", lambda i: ("/logout", {"headers": {"Authorization": f"Bearer {logouts[i]}"}}), fresh_token),
+        "buyers": ("GET", "/buyers", lambda i: ("/buyers", {}), None),
+        "buyers_stream": ("GET", "/buyers", lambda i: ("/buyers?stream=true", {}), None),
+        "categories": ("GET", "/categories", lambda i: ("/categories", {}), None),
+        "categories_with_products": ("GET", "/categories", lambda i: ("/categories?include=products", {}), None),
+        "categories_not_modified": ("GET", "/categories", lambda i: (
+            "/categories", {"headers": {"If-None-Match": etags["/categories"]}}
+        ), lambda client, i: fetch_etag(client, "/categories")),
+        "new_category": ("POST", "/new-category", lambda i: ("/new-category", {"json": {"name": f"New {run} {i}"}}), None),
+        "seller_store": ("GET", "/<int:seller_id>/store", lambda i: (f"/{i % sellers + 1}/store", {}), None),
+        "new_store": ("POST", "/new-store", lambda i: ("/new-store", {"json": {
+            "name": f"Loose store {run} {i}", "description": "bench"
+        }}), None),
+        "stores": ("GET", "/stores", lambda i: ("/stores", {}), None),
+        "stores_stream": ("GET", "/stores", lambda i: ("/stores?stream=true", {}), None),
+        "products": ("GET", "/products", lambda i: (f"/products?cursor={i * 37 % products}", {}), None),
+        "products_filtered": ("GET", "/products", lambda i: (
+            f"/products?category_id={i % counts['categories'] + 1}&min_price=10&max_price=500", {}
+        ), None),
+        "products_by_price": ("GET", "/products", lambda i: (f"/products?sort={['price', '-price'][i % 2]}", {}), None),
+        "products_not_modified": ("GET", "/products", lambda i: (
+            "/products", {"headers": {"If-None-Match": etags["/products"]}}
+        ), lambda client, i: fetch_etag(client, "/products")),
+        "products_stream": ("GET", "/products", lambda i: ("/products?stream=true", {}), None),
+        "products_search": ("GET", "/products/search", lambda i: (
+            f"/products/search?q={['red shoes', 'coffee', 'wooden table', 'leather bag'][i % 4]}", {}
+        ), None),
+        "store_products": ("GET", "/stores/<int:store_id>/products", lambda i: (f"/stores/{i % sellers + 1}/products", {}), None),
+        "new_product": ("POST", "/stores/<int:store_id>/new-product", lambda i: (f"/stores/{i % sellers + 1}/new-product", as_seller(
+            i % sellers + 1, json={
+                "name": f"new product {i}", "description": "bench", "price": "19.99", "amount_available": "10",
+                "active": True, "img_url": "https://img.bench.test/n.png", "category_id": 1
+            }
+        )), None),
+        "import_products": ("POST", "/stores/<int:store_id>/import-products", lambda i: (
+            f"/stores/{i % sellers + 1}/import-products", as_seller(i % sellers + 1, **csv_upload(i))
+        ), None),
+        "products_to_buy": ("GET", "/<int:buyer_id>/products-to-buy", lambda i: (f"/{buyer(i)}/products-to-buy", as_buyer(buyer(i))), None),
+        "add_product": ("POST", "/add-product", lambda i: ("/add-product", as_buyer(buyer(i), json={
+            "buyer_id": buyer(i), "product_id": i % products + 1, "quantity": "1"
+        })), None),
+        "edit_product_to_buy": ("PATCH", "/edit-product-to-buy/<int:id>", lambda i: (
+            f"/edit-product-to-buy/{i % cart_rows + 1}", as_owner(i % cart_rows + 1, json={"quantity": "2"})
+        ), None),
+        "cart_summary": ("GET", "/<int:buyer_id>/cart", lambda i: (f"/{buyer(i)}/cart", as_buyer(buyer(i))), None),
+        "cart_batch": ("POST", "/<int:buyer_id>/cart", lambda i: (f"/{buyer(i)}/cart", as_buyer(buyer(i), json={"operations": [
+            {"op": "add", "product_id": (i * 7 + n) % products + 1, "quantity": 1} for n in range(10)
+        ]})), None),
+        "reserve": ("POST", "/<int:buyer_id>/reserve", lambda i: (f"/{buyer(i)}/reserve", as_buyer(buyer(i))), None),
+        "checkout": ("POST", "/<int:buyer_id>/checkout", lambda i: (f"/{buyer(i)}/checkout", as_buyer(buyer(i))),
+                     lambda client, i: client.post(f"/{buyer(i)}/reserve", **as_buyer(buyer(i)))),
+        # Runs last among the writes, it empties the seeded cart rows
+        "delete_product_to_buy": ("DELETE", "/product-to-delete/<int:id>", lambda i: (
+            f"/product-to-delete/{cart_rows - i}", as_owner(cart_rows - i)
+        ), None),
+    }
+
+def check_coverage(app, benchmarked):
+    """ Warn about the routes without a scenario, so new endpoints get benchmarked """
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == "static" or rule.rule.startswith("/admin"):
+            continue
+        for method in rule.methods - {"HEAD", "OPTIONS"}:
+            if (method, rule.rule) not in benchmarked:
+                print(f"WARNING: {method} {rule.rule} has no benchmark scenario", file=sys.stderr)
+
+def run(app, db, counts, requests):
+    from sqlalchemy import event
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count_query)
+    client = app.test_client()
+    plan = scenarios(app, counts)
+    check_coverage(app, {(method, rule) for method, rule, _, _ in plan.values()})
+
+    results = {}
+    for name, (method, rule, build, setup) in plan.items():
+        # Stream and cart-wide endpoints read whole tables, fewer requests keep runs short
+        total = max(1, requests // 10) if name.endswith("_stream") or name in ("reserve", "checkout", "import_products") else requests
+        latencies, query_counts, errors = [], [], 0
+        for i in range(total):
+            if setup is not None:
+                setup(client, i)
+            path, kwargs = build(i)
+            queries[0] = 0
+            start = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            query_counts.append(queries[0])
+            if response.status_code >= 400:
+                errors += 1
+        latencies.sort()
+        results[name] = {
+            "method": method,
+            "rule": rule,
+            "requests": total,
+            "errors": errors,
+            "throughput_rps": round(total / sum(latencies), 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "queries_per_request": round(sum(query_counts) / total, 2),
+        }
+        print(f"{name:24} {results[name]['throughput_rps']:>10} req/s  p50 {results[name]['p50_ms']:>9} ms  "
+              f"p95 {results[name]['p95_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms  "
+              f"{results[name]['queries_per_request']:>6} queries  {errors} errors")
+    return results
+
+def compare(results, previous_path):
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)["endpoints"]
+    print(f"\nChange against {previous_path} (p95 latency, throughput):")
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        before = previous[name]
+        print(f"{name:24} p95 {before['p95_ms']:>9} -> {result['p95_ms']:>9} ms   "
+              f"{before['throughput_rps']:>10} -> {result['throughput_rps']:>10} req/s")
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    for volume, default in DEFAULT_VOLUMES.items():
+        parser.add_argument(f"--{volume.replace('_', '-')}", type=int, default=default)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the dataset")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--output", help="file to save the results as JSON")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    os.environ["DB_CONNECTION_STRING"] = database_url
+    if args.no_cache:
+        os.environ["CACHE_TTL"] = "0"
+    from main import app
+    from models import db
+
+    volumes = {volume: getattr(args, volume) for volume in DEFAULT_VOLUMES}
+    start = time.perf_counter()
+    with app.app_context():
+        counts = seed(volumes, args.seed)
+        dialect = db.engine.dialect.name
+    print(f"Seeded {dialect} in {time.perf_counter() - start:.1f}s: {counts}")
+
+    results = run(app, db, counts, args.requests)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "database": dialect,
+            "volumes": counts,
+            "requests_per_endpoint": args.requests,
+            "cache": not args.no_cache,
+        },
+        "endpoints": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
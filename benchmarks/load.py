@@ -0,0 +1,81 @@
+"""
+Load test a running server with many concurrent connections.
+
+    SERVING_MODE=gevent gunicorn wsgi --chdir ./src/ --worker-class gevent -b 127.0.0.1:3000 &
+    python benchmarks/load.py --url http://127.0.0.1:3000 --concurrency 500 --duration 30
+
+Every connection requests the paths in turn for --duration seconds, then the
+requests per second, latency percentiles and errors are reported.
+The protected paths, like /<buyer_id>/products-to-buy, need the token of their user (the jwt of /login) in --token.
+Seed the server database first, e.g. with benchmarks/seed.py through benchmarks/endpoints.py.
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from endpoints import percentile
+
+DEFAULT_PATHS = ["/products", "/stores", "/categories", "/products?category_id=1"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:3000")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--path", action="append", dest="paths", help="path to request, can be repeated")
+    parser.add_argument("--token", help="JWT sent in the Authorization header of every request")
+    parser.add_argument("--output", help="file to save the results as JSON")
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def connection(number):
+        own_latencies, own_errors = [], 0
+        i = number
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(args.url + paths[i % len(paths)], headers=headers), timeout=30) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                own_errors += 1
+            own_latencies.append(time.perf_counter() - start)
+            i += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    threads = [threading.Thread(target=connection, args=(number,)) for number in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    results = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compare the peak memory of the streamed list endpoints with building the whole list in one response.
+
+    python benchmarks/memory.py --products 1000000
+
+Seeds a new SQLite database (or --database-url) and measures every case in a
+new Python process, once for the peak RSS and once with tracemalloc for the
+peak of Python allocations (tracemalloc makes it slower, its time is not
+reported). Both are counted from after the app served a first request. The
+products not streamed are the list /products returned before it was paged,
+built with the same schema and encoder. The streamed bodies are read chunk by
+chunk and not kept, like a client writing them somewhere.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from seed import seed
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+CASES = {
+    "products streamed": "/products?stream=true",
+    "products not streamed": None,
+    "stores streamed": "/stores?stream=true",
+    "stores not streamed": "/stores",
+}
+
+PROBE = """
+import json, resource, sys, time, tracemalloc
+from main import app
+from models import Product
+from serializers import PRODUCT_SCHEMA
+from utils import json_response
+
+path, trace = sys.argv[1], sys.argv[2] == "tracemalloc"
+client = app.test_client()
+client.get("/products?limit=1").get_data()
+client.get("/products?stream=true&min_price=1000000").get_data()
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if trace:
+    tracemalloc.start()
+start = time.perf_counter()
+size = 0
+if path == "None":
+    with app.test_request_context():
+        response = json_response({"products": PRODUCT_SCHEMA.all(Product.get_available())})
+        size = len(response.get_data())
+        del response
+else:
+    response = client.get(path)
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+elapsed = time.perf_counter() - start
+traced = tracemalloc.get_traced_memory()[1] if trace else None
+print(json.dumps({
+    "bytes": size,
+    "seconds": elapsed,
+    "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+    "traced_peak_bytes": traced,
+}))
+"""
+
+
+def probe(path, mode):
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE, str(path), mode], cwd=SRC, env=os.environ, stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=20000, help="half of them are sellers with one store each")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "memory.sqlite")
+    os.environ["DB_CONNECTION_STRING"] = database_url
+    # Every probe builds its response, none is served from the cache
+    os.environ["CACHE_TTL"] = "0"
+    from main import app
+
+    with app.app_context():
+        seed({"users": args.users, "categories": 20, "products": args.products, "cart_rows": 0})
+
+    print(f"{'case':24} {'MB sent':>9} {'seconds':>9} {'RSS growth MB':>14} {'traced peak MB':>15}")
+    for case, path in CASES.items():
+        rss = probe(path, "rss")
+        traced = probe(path, "tracemalloc")
+        print(
+            f"{case:24} {rss['bytes'] / 2**20:9.1f} {rss['seconds']:9.2f} "
+            f"{rss['rss_growth_kb'] / 1024:14.1f} {traced['traced_peak_bytes'] / 2**20:15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
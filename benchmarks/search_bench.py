@@ -0,0 +1,85 @@
+"""
+Benchmark /products/search on a catalog with a realistic vocabulary.
+
+    python benchmarks/search_bench.py --products 1000000 --requests 200
+
+The seed of benchmarks/seed.py draws the product texts from 38 words, so every
+word is in about a third of the products and endpoints.py measures searches
+that rank hundreds of thousands of matches. Here the texts are drawn from
+--vocabulary generated words, a word is in about 15 / vocabulary of the
+products, like the names and brands people search in a real catalog. The
+queries are one or two words of the vocabulary, also filtered by category.
+
+Prints the p50/p95/p99 latency and the matches per query, and exits with an
+error when the p95 is above --target-ms (default 50).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from seed import seed
+
+SYLLABLES = "ka lo mi nu re sa ti vo be da fi gu ho ja ke li mo na pe ri so tu ve zi".split()
+
+
+def vocabulary(size, rng):
+    """ size distinct pronounceable words """
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def percentile(sorted_values, fraction):
+    """ Nearest rank percentile of an already sorted list """
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--target-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    os.environ["DB_CONNECTION_STRING"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "search.sqlite")
+    # Every request runs its queries
+    os.environ["CACHE_TTL"] = "0"
+    from main import app
+
+    rng = random.Random(0)
+    words = vocabulary(args.vocabulary, rng)
+    categories = 20
+    with app.app_context():
+        seed({"users": 1000, "categories": categories, "products": args.products, "cart_rows": 0}, vocabulary=words)
+
+    client = app.test_client()
+    client.get("/products/search?q=warmup").get_data()
+    timings, matches = [], []
+    for i in range(args.requests):
+        terms = " ".join(rng.choice(words) for _ in range(1 + i % 2))
+        path = f"/products/search?q={terms}"
+        if i % 3 == 2:
+            path += f"&category_id={rng.randint(1, categories)}"
+        start = time.perf_counter()
+        response = client.get(path)
+        body = response.get_json()
+        timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            sys.exit(f"{path} answered {response.status_code}")
+        matches.append(sum(facet["count"] for facet in body["facets"]["categories"]))
+
+    timings.sort()
+    p95 = percentile(timings, 0.95)
+    print(f"{args.products} products, {args.vocabulary} words, {args.requests} searches")
+    print(f"p50 {percentile(timings, 0.50):8.2f} ms  p95 {p95:8.2f} ms  p99 {percentile(timings, 0.99):8.2f} ms")
+    print(f"matches per search: mean {sum(matches) / len(matches):.0f}  max {max(matches)}")
+    if p95 > args.target_ms:
+        sys.exit(f"p95 {p95:.2f} ms is above the target of {args.target_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Seed a database with generated users, sellers, stores, categories, products and
+cart rows through the models in src/models.py.
+
+The data only depends on the volumes and the random seed, so two runs with the
+same arguments benchmark the same dataset. Every user has the password "password".
+"""
+import random
+import sys
+import os
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+WORDS = (
+    "red blue green black white small large light heavy classic modern organic "
+    "cotton leather wooden steel glass shoes shirt table chair lamp phone case "
+    "bottle bag watch coffee tea book pen notebook jacket hat kitchen garden"
+).split()
+BATCH_SIZE = 5000
+
+DEFAULT_VOLUMES = {
+    "users": 1000,
+    "categories": 20,
+    "products": 10000,
+    "cart_rows": 5000,
+}
+
+
+def words(rng, count, vocabulary=WORDS):
+    return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+def insert(model, rows):
+    from models import db
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.bulk_insert_mappings(model, rows[start:start + BATCH_SIZE])
+        db.session.commit()
+
+def seed(volumes, random_seed=0, vocabulary=WORDS):
+    """ Create the tables and fill them, must run in an app context on an empty database.
+        Half of the users are sellers, each with one store, and half are buyers.
+        The names and descriptions of the products are random words of the vocabulary.
+        Return the number of rows of every table.
+    """
+    from models import db, User, Buyer, Seller, Category, Store, Product, ProductToBuy
+    rng = random.Random(random_seed)
+    db.create_all()
+
+    # Hashing is slow on purpose, every user shares the same salt and hash
+    template = User(email="template@bench.test", password="password")
+    sellers = volumes["users"] // 2
+    buyers = volumes["users"] - sellers
+
+    insert(User, [
+        {
+            "id": i, "email": f"user{i}@bench.test", "salt": template.salt,
+            "hashed_password": template.hashed_password, "is_active": True
+        }
+        for i in range(1, volumes["users"] + 1)
+    ])
+    insert(Seller, [
+        {
+            "id": i, "company_name": f"Company {i}", "identification_number": f"NIT{i}",
+            "cellphone_number": "3000000000", "user_id": i
+        }
+        for i in range(1, sellers + 1)
+    ])
+    insert(Store, [
+        {"id": i, "name": f"Store {i}", "description": words(rng, 6), "seller_id": i}
+        for i in range(1, sellers + 1)
+    ])
+    insert(Buyer, [
+        {
+            "id": i, "first_name": f"Buyer{i}", "last_name": "Bench", "id_number": f"{i:010d}",
+            "cellphone_number": "3000000000", "address": "Calle 1", "user_id": sellers + i
+        }
+        for i in range(1, buyers + 1)
+    ])
+    insert(Category, [
+        {"id": i, "name": f"Category {i}"}
+        for i in range(1, volumes["categories"] + 1)
+    ])
+    insert(Product, [
+        {
+            "id": i, "name": words(rng, 3, vocabulary), "description": words(rng, 12, vocabulary),
+            "price": Decimal(rng.randint(100, 100000)) / 100, "amount_available": 1000000,
+            "active": rng.random() < 0.9, "img_url": f"https://img.bench.test/{i}.png",
+            "category_id": rng.randint(1, volumes["categories"]), "store_id": rng.randint(1, sellers)
+        }
+        for i in range(1, volumes["products"] + 1)
+    ])
+    insert(ProductToBuy, [
+        {
+            "id": i, "buyer_id": rng.randint(1, buyers), "product_id": rng.randint(1, volumes["products"]),
+            "quantity": rng.randint(1, 3)
+        }
+        for i in range(1, volumes["cart_rows"] + 1)
+    ])
+    if db.engine.dialect.name == "postgresql":
+        # The ids were given explicitly, move the sequences past them
+        for model in (User, Seller, Store, Buyer, Category, Product, ProductToBuy):
+            table = f'"{model.__tablename__}"'
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+            ))
+        db.session.commit()
+    return {"sellers": sellers, "stores": sellers, "buyers": buyers, **volumes}
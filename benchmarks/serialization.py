@@ -0,0 +1,61 @@
+"""
+Compare the ORM serializers with the schema serializers on the products list.
+
+    python benchmarks/serialization.py --products 100000
+
+Times, on the same seeded rows, loading the products as ORM objects and encoding
+their serialize() dictionaries with jsonify, against selecting only the schema
+columns and encoding the rows with utils.dumps (orjson when it is installed).
+"""
+import argparse
+import os
+import tempfile
+import time
+from seed import seed
+
+
+def best_of(repeat, function):
+    """ Return the fastest of repeat runs, and the result of the last one """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ["DB_CONNECTION_STRING"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serialization.sqlite")
+    from flask import jsonify
+    from main import app
+    from models import Product
+    from serializers import PRODUCT_SCHEMA
+    from utils import dumps
+
+    with app.app_context():
+        seed({"users": 20, "categories": 20, "products": args.products, "cart_rows": 0})
+
+    with app.test_request_context():
+        def orm():
+            products = Product.loaded_query().order_by(Product.id).all()
+            return jsonify({"products": [product.serialize() for product in products]}).get_data()
+
+        def schema():
+            return dumps({"products": PRODUCT_SCHEMA.all(Product.query.order_by(Product.id))})
+
+        orm_seconds, orm_body = best_of(args.repeat, orm)
+        schema_seconds, schema_body = best_of(args.repeat, schema)
+
+    print(f"{args.products} products, best of {args.repeat}")
+    print(f"serialize() + jsonify  {orm_seconds * 1000:>10.1f} ms  {len(orm_body):>12} bytes")
+    print(f"schema + dumps         {schema_seconds * 1000:>10.1f} ms  {len(schema_body):>12} bytes")
+    print(f"speedup                {orm_seconds / schema_seconds:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
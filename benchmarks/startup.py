@@ -0,0 +1,67 @@
+"""
+Measure how long a worker takes to boot: importing the app and serving its first requests.
+
+    python benchmarks/startup.py --runs 10
+
+Every run is a new Python process, like a new worker without --preload. It
+reports the median time to import src/wsgi.py, to serve the first request to
+the API and the first request to /admin, and if the heavy optional packages
+were imported before the first admin request.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from seed import seed
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+client = wsgi.application.test_client()
+client.get("/products").get_data()
+first_request = time.perf_counter()
+loaded = [name for name in ("flask_admin", "flask_migrate", "alembic", "flask_swagger") if name in sys.modules]
+client.get("/admin/").get_data()
+first_admin_request = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (first_request - imported) * 1000,
+    "first_admin_request_ms": (first_admin_request - first_request) * 1000,
+    "loaded_before_admin": loaded,
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.sqlite")
+    os.environ["DB_CONNECTION_STRING"] = database_url
+    from main import app
+
+    with app.app_context():
+        seed({"users": 20, "categories": 5, "products": 100, "cart_rows": 0})
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=SRC, env=os.environ, stderr=subprocess.DEVNULL)
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    for metric in ("import_ms", "first_request_ms", "first_admin_request_ms"):
+        values = [run[metric] for run in runs]
+        print(f"{metric:24} median {statistics.median(values):9.1f} ms  min {min(values):9.1f} ms  max {max(values):9.1f} ms")
+    print(f"imported before the first admin request: {', '.join(runs[-1]['loaded_before_admin']) or 'none of them'}")
+
+
+if __name__ == "__main__":
+    main()
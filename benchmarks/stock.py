@@ -0,0 +1,69 @@
+"""
+Hammer the reservation of one hot product from many threads and check it never oversells.
+
+    python benchmarks/stock.py --threads 200 --stock 50
+
+Every thread is a different buyer with the product in its cart. Exactly --stock
+reservations must succeed and the stock must end at zero.
+Run it against Postgres or MySQL with --database-url to exercise their row locks.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from seed import seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="an empty database to seed, a new SQLite file by default")
+    parser.add_argument("--threads", type=int, default=100)
+    parser.add_argument("--stock", type=int, default=25)
+    args = parser.parse_args()
+
+    os.environ["DB_CONNECTION_STRING"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stock.sqlite")
+    from main import app
+    from models import db, Product, ProductToBuy
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        seed({"users": args.threads * 2, "categories": 1, "products": 1, "cart_rows": 0})
+        Product.query.filter_by(id = 1).update({"amount_available": args.stock})
+        db.session.bulk_insert_mappings(ProductToBuy, [
+            {"buyer_id": buyer_id, "product_id": 1, "quantity": 1} for buyer_id in range(1, args.threads + 1)
+        ])
+        db.session.commit()
+        # The seed makes the first half of the users sellers, buyer n is the user threads + n
+        tokens = {buyer_id: create_access_token(identity=str(args.threads + buyer_id)) for buyer_id in range(1, args.threads + 1)}
+
+    statuses = []
+    barrier = threading.Barrier(args.threads)
+
+    def reserve(buyer_id):
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(client.post(f"/{buyer_id}/reserve", headers={"Authorization": f"Bearer {tokens[buyer_id]}"}).status_code)
+
+    threads = [threading.Thread(target=reserve, args=(buyer_id,)) for buyer_id in range(1, args.threads + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        stock = Product.query.get(1).amount_available
+    reserved = statuses.count(201)
+    print(f"{args.threads} buyers in {elapsed:.2f}s: {reserved} reserved, {statuses.count(409)} out of stock, "
+          f"{len(statuses) - reserved - statuses.count(409)} errors, stock left {stock}")
+    if stock < 0 or reserved != args.stock or stock != 0:
+        print("FAIL: the stock was oversold or lost", file=sys.stderr)
+        sys.exit(1)
+    print("OK: no overselling")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# Gunicorn settings and hooks, read from the working directory where gunicorn starts (see the Procfile).
+import gc
+import os
+
+# Import the app in the master and fork the workers from it, they boot faster and share its memory
+preload_app = os.environ.get('PRELOAD', 'false').lower() in ("1", "true", "yes")
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        # Keep the objects of the preloaded app out of the garbage collector: collecting them in the
+        # workers would write to their memory pages and end the copy-on-write sharing
+        gc.freeze()
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        import wsgi
+        wsgi.after_fork(wsgi.application)
@@ -1,28 +1,68 @@
 import os
-from flask_admin import Admin
+import threading
+from flask import Flask
 from models import db, User, Buyer, Category, Store, Product, Seller, ProductToBuy
-from flask_admin.contrib.sqla import ModelView
+
+ADMIN_URL = "/admin"
 
 def setup_admin(app):
+    from flask_admin import Admin
+    from admin_views import UserView, BuyerView, SellerView, CategoryView, StoreView, ProductView, ProductToBuyView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3', url=ADMIN_URL)
+
 
-    
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(UserView(User, db.session))
+
+    admin.add_view(BuyerView(Buyer, db.session))
+
+    admin.add_view(SellerView(Seller, db.session))
+
+    admin.add_view(CategoryView(Category, db.session))
+
+    admin.add_view(StoreView(Store, db.session))
+
+    admin.add_view(ProductView(Product, db.session))
+
+    admin.add_view(ProductToBuyView(ProductToBuy, db.session))
 
-    admin.add_view(ModelView(Buyer, db.session))
+    # You can duplicate that line to add mew models, FastModelView (in admin_views.py) suits big tables
+    # admin.add_view(FastModelView(YourModelName, db.session))
 
-    admin.add_view(ModelView(Seller, db.session))
 
-    admin.add_view(ModelView(Category, db.session))
+class LazyAdmin(object):
+    """ WSGI middleware serving ADMIN_URL from an admin app that is only built on its first request,
+        so the workers don't import Flask-Admin nor register its views on boot
+    """
 
-    admin.add_view(ModelView(Store, db.session))
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._admin_app = None
+        self._lock = threading.Lock()
 
-    admin.add_view(ModelView(Product, db.session))
+    def admin_app(self):
+        if self._admin_app is None:
+            with self._lock:
+                if self._admin_app is None:
+                    admin_app = Flask(self.app.import_name)
+                    admin_app.config.update(self.app.config)
+                    db.init_app(admin_app)
+                    # Use the engine, and its connection pool, of the app instead of opening another one
+                    admin_app.extensions['sqlalchemy'] = self.app.extensions['sqlalchemy']
+                    setup_admin(admin_app)
+                    self._admin_app = admin_app
+        return self._admin_app
 
-    admin.add_view(ModelView(ProductToBuy, db.session))
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == ADMIN_URL or path.startswith(ADMIN_URL + "/"):
+            return self.admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
 
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+def setup_lazy_admin(app):
+    """ Serve the admin of the app, built on the first request to it """
+    app.wsgi_app = LazyAdmin(app)
@@ -0,0 +1,117 @@
+"""
+Admin views of the models, tuned for large tables. Imported with Flask-Admin on the
+first request to /admin (see admin.LazyAdmin).
+
+Every list pages with LIMIT/OFFSET sorted by an indexed column, eager loads the
+relationships it shows, and searches and filters on indexed columns only. The
+one-to-many relationships are left out of the forms and the many-to-one ones are
+picked with an AJAX search, so a form never loads a whole table.
+
+Tables the database estimates at ADMIN_APPROXIMATE_COUNT_MIN_ROWS rows or more
+(default 100000) show that estimate instead of running COUNT(*).
+"""
+import os
+from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import text
+from models import db
+
+ADMIN_APPROXIMATE_COUNT_MIN_ROWS = int(os.environ.get('ADMIN_APPROXIMATE_COUNT_MIN_ROWS', 100000))
+
+ESTIMATED_ROWS_SQL = {
+    "postgresql": "SELECT reltuples::bigint FROM pg_class WHERE relname = :table",
+    "mysql": "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table",
+}
+
+
+def estimated_rows(session, tablename):
+    """ The number of rows of the table according to the statistics of the database, None if it doesn't keep them """
+    sql = ESTIMATED_ROWS_SQL.get(db.engine.dialect.name)
+    if sql is None:
+        return None
+    estimate = session.execute(text(sql), {"table": tablename}).scalar()
+    # Postgres says -1 for tables never analyzed
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+class FastModelView(ModelView):
+    """ ModelView that never counts big tables """
+    page_size = 50
+    can_set_page_size = True
+    column_display_pk = True
+    column_default_sort = ("id", True)
+    # get_list() counts the rows itself, only when it is cheap
+    simple_list_pager = True
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        count, query = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        if search or filters:
+            # Counting the matches may scan the table, the list only gets previous and next buttons
+            return count, query
+        count = estimated_rows(self.session, self.model.__tablename__)
+        if count is None or count < ADMIN_APPROXIMATE_COUNT_MIN_ROWS:
+            count = self.get_count_query().scalar()
+        return count, query
+
+
+class UserView(FastModelView):
+    column_list = ("id", "email", "is_active", "user_buyer", "user_seller")
+    column_select_related_list = ("user_buyer", "user_seller")
+    column_searchable_list = ("email",)
+    column_filters = ("is_active",)
+    column_sortable_list = ("id", "email")
+
+
+class BuyerView(FastModelView):
+    column_list = ("id", "id_number", "first_name", "last_name", "cellphone_number", "address", "user_id")
+    column_searchable_list = ("id_number",)
+    column_filters = ("user_id",)
+    column_sortable_list = ("id", "id_number")
+    form_excluded_columns = ("product_to_buy",)
+    form_ajax_refs = {"user": {"fields": ("email",)}}
+
+
+class SellerView(FastModelView):
+    column_list = ("id", "company_name", "identification_number", "cellphone_number", "user_id")
+    column_searchable_list = ("company_name", "identification_number")
+    column_filters = ("user_id",)
+    column_sortable_list = ("id", "company_name")
+    form_ajax_refs = {"user": {"fields": ("email",)}}
+
+
+class CategoryView(FastModelView):
+    column_list = ("id", "name")
+    column_searchable_list = ("name",)
+    column_sortable_list = ("id", "name")
+    form_excluded_columns = ("products",)
+
+
+class StoreView(FastModelView):
+    column_list = ("id", "name", "description", "seller_id")
+    column_searchable_list = ("name",)
+    column_filters = ("seller_id",)
+    column_sortable_list = ("id", "name")
+    form_excluded_columns = ("products",)
+
+
+class ProductView(FastModelView):
+    column_list = ("id", "name", "price", "amount_available", "active", "category", "store")
+    column_select_related_list = ("category", "store")
+    # The name has no index, filter by the indexed columns instead of searching it
+    column_filters = ("active", "category_id", "store_id", "price")
+    column_sortable_list = ("id", "price")
+    form_excluded_columns = ("product_to_buy",)
+    form_ajax_refs = {
+        "category": {"fields": ("name",)},
+        "store": {"fields": ("name",)},
+    }
+
+
+class ProductToBuyView(FastModelView):
+    column_list = ("id", "buyer_id", "product", "quantity")
+    column_select_related_list = ("product",)
+    column_filters = ("buyer_id", "product_id")
+    column_sortable_list = ("id",)
+    form_ajax_refs = {
+        "buyer": {"fields": ("id_number",)},
+        "product": {"fields": ("name",)},
+    }
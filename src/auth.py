@@ -0,0 +1,172 @@
+"""
+Authentication of the protected routes with the JWT issued by /login.
+
+flask_jwt_extended decodes the token once per request. What its user may act as
+(role, buyer, seller and stores) is read from the database the first time a
+token is seen and kept, keyed by the jti of the token, until the token expires
+in an LRU of AUTH_CACHE_MAXSIZE tokens (default 10000). Later requests with the
+same token don't query the database.
+
+Revoked tokens are checked against an in-memory set of the jti in RevokedToken.
+Every REVOCATION_SYNC_SECONDS seconds (default 5) a worker compares the version
+of that table with the one it loaded and reloads the set if it changed, so a
+logout reaches every worker within that time, and the worker that served it
+right away.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import JWTManager, verify_jwt_in_request, get_current_user, get_jwt
+from cache import LRUCache
+from models import User, RevokedToken, TableVersion
+from utils import APIException
+
+AUTH_CACHE_MAXSIZE = int(os.environ.get('AUTH_CACHE_MAXSIZE', 10000))
+REVOCATION_SYNC_SECONDS = float(os.environ.get('REVOCATION_SYNC_SECONDS', 5))
+
+# What the user of a token may act as, store_ids are the stores of its seller
+Principal = namedtuple("Principal", ("user_id", "role", "buyer_id", "seller_id", "store_ids"))
+
+
+class RevocationList(object):
+    """ jti of the revoked tokens, reloaded from the database when its table changes """
+
+    def __init__(self, sync_seconds):
+        self.sync_seconds = sync_seconds
+        self._revoked = frozenset()
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """ Reload the revoked tokens if the version of their table is not the loaded one """
+        tablename = RevokedToken.__tablename__
+        # Read before the rows, a revocation in between only makes the next check reload again
+        version = TableVersion.get_versions([tablename]).get(tablename)
+        if version is None or version[0] != self._version:
+            revoked = frozenset(jti for jti, _ in RevokedToken.get_unexpired())
+            with self._lock:
+                self._revoked = revoked
+                self._version = None if version is None else version[0]
+
+    def is_revoked(self, jti):
+        now = time.monotonic()
+        with self._lock:
+            due = self._checked_at is None or now - self._checked_at >= self.sync_seconds
+            if due:
+                self._checked_at = now
+        if due:
+            self.sync()
+        return jti in self._revoked
+
+    def add(self, jti):
+        """ Revoke the token in this process without waiting for the next reload """
+        with self._lock:
+            self._revoked = self._revoked | {jti}
+
+
+revocation_list = RevocationList(REVOCATION_SYNC_SECONDS)
+# Tokens without expiration are kept the default ttl
+principals = LRUCache(maxsize=AUTH_CACHE_MAXSIZE, ttl=900)
+
+
+def resolve_principal(jwt_data):
+    """ Return the Principal of the token, None if its user doesn't exist or is not active """
+    jti = jwt_data["jti"]
+    principal = principals.get(jti)
+    if principal is not None:
+        return principal
+    user_id = int(jwt_data["sub"])
+    access = User.get_access(user_id)
+    if access is None or not access["is_active"]:
+        return None
+    principal = Principal(
+        user_id = user_id,
+        role = "buyer" if access["seller_id"] is None else "seller",
+        buyer_id = access["buyer_id"],
+        seller_id = access["seller_id"],
+        store_ids = access["store_ids"]
+    )
+    expires = jwt_data.get("exp")
+    principals.set(jti, principal, None if expires is None else max(0, expires - time.time()))
+    return principal
+
+def setup_auth(app):
+    """ Create the JWTManager of the app with the cached user lookup and the revocation list """
+    jwt = JWTManager(app)
+
+    @jwt.token_in_blocklist_loader
+    def token_revoked(jwt_header, jwt_data):
+        return revocation_list.is_revoked(jwt_data["jti"])
+
+    @jwt.user_lookup_loader
+    def user_lookup(jwt_header, jwt_data):
+        return resolve_principal(jwt_data)
+
+    @jwt.unauthorized_loader
+    def missing_token(reason):
+        return jsonify({"msg": "Falta el token de autorización"}), 401
+
+    @jwt.invalid_token_loader
+    def invalid_token(reason):
+        return jsonify({"msg": "El token no es válido"}), 401
+
+    @jwt.expired_token_loader
+    def expired_token(jwt_header, jwt_data):
+        return jsonify({"msg": "El token expiró"}), 401
+
+    @jwt.revoked_token_loader
+    def revoked_token(jwt_header, jwt_data):
+        return jsonify({"msg": "El token fue revocado"}), 401
+
+    @jwt.user_lookup_error_loader
+    def user_not_found(jwt_header, jwt_data):
+        return jsonify({"msg": "El usuario no existe o está inactivo"}), 401
+
+    return jwt
+
+def current_principal():
+    """ The Principal of the token of the request, verified by one of the decorators below """
+    return get_current_user()
+
+def revoke_current_token():
+    """ Revoke the token of the request until it expires """
+    jwt_data = get_jwt()
+    RevokedToken.revoke(jwt_data["jti"], datetime.utcfromtimestamp(jwt_data["exp"]))
+    revocation_list.add(jwt_data["jti"])
+    principals.delete(jwt_data["jti"])
+
+
+def login_required(view):
+    """ Let through the requests with a valid token """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        return view(*args, **kwargs)
+    return wrapper
+
+def buyer_required(view):
+    """ Let through the buyers, and if the route has a buyer_id only the buyer with that id """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        principal = current_principal()
+        if principal.buyer_id is None or kwargs.get("buyer_id", principal.buyer_id) != principal.buyer_id:
+            raise APIException("No tiene permiso sobre este carrito", status_code=403)
+        return view(*args, **kwargs)
+    return wrapper
+
+def seller_required(view):
+    """ Let through the sellers, and if the route has a store_id only the seller of that store """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        verify_jwt_in_request()
+        principal = current_principal()
+        if principal.seller_id is None or ("store_id" in kwargs and kwargs["store_id"] not in principal.store_ids):
+            raise APIException("No tiene permiso sobre esta tienda", status_code=403)
+        return view(*args, **kwargs)
+    return wrapper
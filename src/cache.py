@@ -0,0 +1,122 @@
+"""
+Read-through cache for the serialized responses of the read-heavy endpoints.
+
+Entries are keyed by the version of every table they were built from, as
+stored in the database (see TableVersion and conditional.table_versions), so
+every worker sees a write as soon as it bumps the version of its table, and the
+stale entries are never read again, they just age out of the backend.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ In-process cache, evicts the least recently used entry and expires entries after ttl seconds """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ Keep the value ttl seconds, the ttl of the cache by default """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SharedCache(object):
+    """ Cache shared by every worker, backed by a client with the redis interface
+        (redis.Redis or any local stand-in implementing get, set and delete)
+    """
+
+    def __init__(self, client, ttl=60, prefix="cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class ResponseCache(object):
+    """ Cache values built from the rows of some tables, invalidated by table """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, name, versions):
+        return name + "|" + ",".join(f"{tablename}:{version}" for tablename, version in sorted(versions.items()))
+
+    def get_or_set(self, name, versions, builder):
+        """ Return the value cached under name, calling builder() on a miss.
+            versions is tablename -> version of the tables the value is read from.
+        """
+        key = self._key(name, versions)
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = builder()
+            self.backend.set(key, value)
+        return value
+
+    def set(self, name, versions, value):
+        """ Replace the value cached under name for versions """
+        self.backend.set(self._key(name, versions), value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None
+        }
+
+
+def cache_from_env():
+    """ Use the shared backend when CACHE_URL is set (needs the redis package), the in-process one otherwise """
+    ttl = int(os.environ.get('CACHE_TTL', 60))
+    url = os.environ.get('CACHE_URL')
+    if url:
+        import redis
+        return ResponseCache(SharedCache(redis.Redis.from_url(url), ttl=ttl))
+    return ResponseCache(LRUCache(maxsize=int(os.environ.get('CACHE_MAXSIZE', 1024)), ttl=ttl))
+
+
+cache = cache_from_env()
@@ -0,0 +1,107 @@
+"""
+In-process index of the categories with the number of available products and
+of stores selling them.
+
+It is built when the worker starts (see wsgi.py) with a grouped query of the
+products and a query of the category names, and remembers the versions of the
+category table and of the product listing it was loaded at (see TableVersion
+and PRODUCT_LISTING). The listing version only changes with the products
+created, deleted, activated or moved to another category or store, not with
+their stock, so the reservations and checkouts don't make it reload.
+
+It is reloaded when a request sees other versions, so it is never older than
+the ETag of /categories. The versions are the ones conditional() already read
+for the request, checking them costs no query. One request reloads it at a time,
+the ones waiting use what it loaded. Writes that skip the versions (by hand in
+the database) are picked up by reloading it when it is older than
+CATEGORY_INDEX_MAX_AGE seconds (default 60).
+"""
+import logging
+import os
+import threading
+import time
+from sqlalchemy.exc import SQLAlchemyError
+from conditional import table_versions
+from models import db, Category, Product, PRODUCT_LISTING
+
+CATEGORY_INDEX_MAX_AGE = float(os.environ.get('CATEGORY_INDEX_MAX_AGE', 60))
+# What the index is read from, /categories has to read these versions too
+INDEX_VERSIONS = (Category, PRODUCT_LISTING)
+
+logger = logging.getLogger("category_index")
+
+
+class CategoryIndex(object):
+    """ id -> name and the available products per store of every category """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._names = None
+        self._products = {}
+        self._versions = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def load(self, versions):
+        """ Read the whole index from the database, versions are the ones of its tables read before.
+            Return it as (names, products)
+        """
+        # Grouped on its own, joined to the categories SQLite reads the active products once per category
+        counts = db.session.query(Product.category_id, Product.store_id, db.func.count()).filter(
+            Product.active == True
+        ).group_by(Product.category_id, Product.store_id)
+        names = dict(db.session.query(Category.id, Category.name))
+        products = {category_id: {} for category_id in names}
+        for category_id, store_id, count in counts:
+            if category_id in products:
+                products[category_id][store_id] = count
+        with self._lock:
+            self._names, self._products, self._versions = names, products, versions
+            self._loaded_at = time.monotonic()
+        return names, products
+
+    def build(self):
+        """ Load the index before the first request, must run in an app context.
+            A database that can't be read yet (before its first migration) leaves it to the first request
+        """
+        try:
+            self.load(table_versions(INDEX_VERSIONS))
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            logger.warning("The category index will be loaded by the first request: %s", error)
+
+    def current(self, versions):
+        """ Return (names, products) if the index was loaded at versions and has not expired, else (None, None) """
+        with self._lock:
+            if self._names is not None and self._versions == versions and time.monotonic() - self._loaded_at <= self.max_age:
+                return self._names, self._products
+        return None, None
+
+    def snapshot(self):
+        """ Return (names, products) of the index, loading it if the tables changed since or it expired """
+        versions = table_versions(INDEX_VERSIONS)
+        names, products = self.current(versions)
+        if names is None:
+            with self._load_lock:
+                # Another request may have loaded it while this one waited
+                names, products = self.current(versions)
+                if names is None:
+                    names, products = self.load(versions)
+        return names, products
+
+    def categories(self):
+        """ Return the categories ordered by id with their counts """
+        names, products = self.snapshot()
+        return [
+            {
+                "id": category_id,
+                "name": name,
+                "product_count": sum(products[category_id].values()),
+                "store_count": len(products[category_id])
+            }
+            for category_id, name in sorted(names.items())
+        ]
+
+
+category_index = CategoryIndex(CATEGORY_INDEX_MAX_AGE)
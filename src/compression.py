@@ -0,0 +1,99 @@
+"""
+Compression of the responses, negotiated with the Accept-Encoding of the client.
+
+Settings from the environment:
+    COMPRESS_MIN_SIZE: bodies smaller than this many bytes are sent as they are (default 1000)
+    COMPRESS_GZIP_LEVEL: 1 (fastest) to 9 (smallest) (default 6)
+    COMPRESS_BROTLI_LEVEL: 0 (fastest) to 11 (smallest) (default 4)
+
+Brotli is offered when the brotli package is installed, gzip otherwise.
+The responses of the response cache are stored with their body compressed in
+the encodings clients asked for (see cached_json_response): an encoding is
+compressed on its first request and added to the entry, so a hit in an
+encoding already asked for never compresses again, and an encoding nobody
+asks for is never compressed.
+"""
+import gzip
+import os
+from flask import request, Response
+from cache import cache
+from conditional import table_versions
+from utils import dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1000))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_LEVEL = int(os.environ.get('COMPRESS_BROTLI_LEVEL', 4))
+
+# In order of preference
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+
+def compress(data, encoding):
+    """ Return data compressed with encoding, one of ENCODINGS """
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_LEVEL)
+    # mtime=0 keeps the output the same for the same data
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def accepted_encoding():
+    """ The preferred of ENCODINGS the client accepts, None if it accepts none of them """
+    for encoding in ENCODINGS:
+        if request.accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+def precompress(variants, encoding):
+    """ Return the variants of a body ({None: body, encoding: compressed body}) with the body in encoding added.
+        The same variants if they have it already, or the body is too small to be worth compressing
+    """
+    if encoding in variants or len(variants[None]) < COMPRESS_MIN_SIZE:
+        return variants
+    return {**variants, encoding: compress(variants[None], encoding)}
+
+def encoded_response(variants, encoding, status=200, mimetype="application/json"):
+    """ Return the response with the variant of the body in encoding, the body as it is if it has none """
+    response = Response(variants.get(encoding, variants[None]), status=status, mimetype=mimetype)
+    if len(variants[None]) >= COMPRESS_MIN_SIZE:
+        response.vary.add("Accept-Encoding")
+    if encoding is not None and encoding in variants:
+        response.content_encoding = encoding
+    return response
+
+def cached_json_response(name, models, builder, status=200):
+    """ Like cache.get_or_set with the versions of the models, caching the JSON of what builder() returns
+        with its variants in the encodings asked for so far
+    """
+    versions = table_versions(models)
+    encoding = accepted_encoding()
+    cached = cache.get_or_set(name, versions, lambda: precompress({None: dumps(builder())}, encoding))
+    variants = precompress(cached, encoding)
+    if variants is not cached:
+        # The first request in this encoding since the body was cached
+        cache.set(name, versions, variants)
+    return encoded_response(variants, encoding, status)
+
+def compress_response(response):
+    """ Compress the responses not compressed already, if they are big enough and of a compressible type """
+    if (response.direct_passthrough or response.is_streamed or response.content_encoding
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code < 200
+            or response.status_code in (204, 206, 304)):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding()
+    if encoding is not None:
+        response.set_data(compress(body, encoding))
+        response.content_encoding = encoding
+    return response
+
+def setup_compression(app):
+    """ Compress the responses of the app """
+    app.after_request(compress_response)
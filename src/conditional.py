@@ -0,0 +1,75 @@
+"""
+HTTP conditional requests for the catalog endpoints.
+
+The ETag of a response is derived from the URL and the versions of the tables
+it is read from (see TableVersion), and its Last-Modified from the last write
+to them. Reading the versions is a single small query, so a client that
+already has the current version gets a 304 without the endpoint running.
+
+The versions read are kept for the request, the views build their bodies from
+caches keyed by them (see table_versions), so a body is never older than its ETag.
+"""
+import hashlib
+from functools import wraps
+from flask import g, request, make_response, Response
+from models import TableVersion, VERSIONED_TABLES
+
+
+def read_versions(tablenames):
+    """ Return tablename -> (version, updated_at) of the tables in one query, (0, None) for the ones without a row """
+    versions = TableVersion.get_versions(tablenames)
+    return {name: versions.get(name, (0, None)) for name in tablenames}
+
+def version_names(sources):
+    """ The names of the versions of the sources, a source is a model or the name of a version like PRODUCT_LISTING.
+        Raise ValueError for a source without a version, its writes would never change the ETag
+    """
+    names = [source if isinstance(source, str) else source.__tablename__ for source in sources]
+    unversioned = [name for name in names if name not in VERSIONED_TABLES]
+    if unversioned:
+        raise ValueError(f"{', '.join(unversioned)} not in models.VERSIONED_TABLES")
+    return names
+
+def table_versions(models):
+    """ Return tablename -> version of the models, the versions conditional() read for the request if it did """
+    tablenames = version_names(models)
+    known = g.get("table_versions", {})
+    if not all(name in known for name in tablenames):
+        known = read_versions(tablenames)
+    return {name: known[name][0] for name in tablenames}
+
+
+def conditional(*models):
+    """ Decorate a GET view whose response only depends on the URL and the rows of models """
+    tablenames = version_names(models)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = read_versions(tablenames)
+            g.table_versions = versions
+            state = ",".join(f"{name}:{versions[name][0]}" for name in tablenames)
+            etag = hashlib.sha1(f"{request.full_path}|{state}".encode("utf-8")).hexdigest()
+            updated = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+            last_modified = max(updated).replace(microsecond=0) if updated else None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since.replace(tzinfo=None))
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak, the same representation may be sent compressed or not
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Let clients and proxies store the response, but have them revalidate it every time
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
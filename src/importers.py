@@ -0,0 +1,114 @@
+"""
+Streaming import of a store catalog from a CSV or NDJSON upload.
+
+The upload is read line by line and written in batches, so memory stays the same
+whatever the size of the file.
+"""
+import csv
+import json
+from models import db, Product, Category, track_writes, integer, PRODUCT_LISTING, MAX_INTEGER
+
+CSV_CONTENT_TYPES = ("text/csv",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+REQUIRED_FIELDS = ("name", "description", "price", "amount_available", "img_url", "category_id")
+MAX_LENGTHS = {"name": 120, "description": 240, "img_url": 360}
+# Only the first errors are reported, so the report doesn't grow with the file
+MAX_REPORTED_ERRORS = 100
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(stream, content_type):
+    """ Yield (row number, row dictionary or RowError) for every row of the upload """
+    lines = (line.decode("utf-8", errors="replace") for line in stream)
+    if content_type in CSV_CONTENT_TYPES:
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row
+    else:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield number, RowError(f"JSON inválido: {error}")
+                continue
+            if not isinstance(row, dict):
+                yield number, RowError("Cada línea debe ser un objeto JSON")
+                continue
+            yield number, row
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ("1", "true", "yes", "si", "sí"):
+        return True
+    if str(value).strip().lower() in ("", "0", "false", "no"):
+        return False
+    raise RowError(f"active no es válido: {value}")
+
+def validate_product(row, store_id, category_ids):
+    """ Return the mapping to insert for a row, raise RowError if the row is not valid """
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ""):
+            raise RowError(f"Falta el campo {field}")
+    for field, max_length in MAX_LENGTHS.items():
+        if len(str(row[field])) > max_length:
+            raise RowError(f"{field} supera los {max_length} caracteres")
+    try:
+        price = Product.valid_price(row["price"])
+    except ValueError as error:
+        raise RowError(str(error))
+    try:
+        # Whole numbers only, the NDJSON 1.7 is not truncated to 1
+        amount_available = integer(row["amount_available"])
+        category_id = integer(row["category_id"])
+    except (ValueError, TypeError, OverflowError):
+        raise RowError("amount_available y category_id deben ser números enteros")
+    if amount_available < 0:
+        raise RowError(f"amount_available debe estar entre 0 y {MAX_INTEGER}")
+    if category_id not in category_ids:
+        raise RowError(f"La categoría {category_id} no existe")
+    return {
+        "name": str(row["name"]),
+        "description": str(row["description"]),
+        "price": price,
+        "amount_available": amount_available,
+        "active": parse_bool(row.get("active", True)),
+        "img_url": str(row["img_url"]),
+        "category_id": category_id,
+        "store_id": store_id
+    }
+
+def import_products(stream, content_type, store_id, batch_size):
+    """ Insert the valid rows of the upload as products of the store, committing every batch_size rows.
+        Return a report with the imported and failed rows.
+    """
+    category_ids = {category_id for category_id, in db.session.query(Category.id)}
+    report = {"imported": 0, "failed": 0, "errors": []}
+    batch = []
+
+    def write(batch):
+        db.session.bulk_insert_mappings(Product, batch)
+        track_writes(db.session, Product.__tablename__, PRODUCT_LISTING)
+        db.session.commit()
+        report["imported"] += len(batch)
+
+    for number, row in read_rows(stream, content_type):
+        try:
+            if isinstance(row, RowError):
+                raise row
+            batch.append(validate_product(row, store_id, category_ids))
+        except RowError as error:
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": number, "error": str(error)})
+            continue
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    return report
@@ -2,16 +2,26 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for, Blueprint
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import click
+from flask import Flask, request, jsonify, url_for, Blueprint, Response
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from utils import APIException, generate_sitemap, query_param, body_field, wants_stream, stream_json_list, json_response, STREAM_BATCH_SIZE
+from serializers import BUYER_SCHEMA, PRODUCT_SCHEMA
+from admin import setup_lazy_admin
+from cache import cache
+from pool import engine_options, set_mysql_statement_timeout, pool_metrics
+from metrics import setup_metrics, request_metrics
+from search import search_products, create_search_index
+from conditional import conditional
+from category_index import category_index
+from compression import setup_compression, cached_json_response
+from typed_columns import upgrade_typed_columns, ConversionError
+from auth import setup_auth, current_principal, revoke_current_token, login_required, buyer_required, seller_required
+from importers import import_products, CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES
 #Modelos de datos
-from models import db, User, Buyer, Seller, Category, Store, Product, ProductToBuy
+from models import db, Crud, User, Buyer, Seller, Category, Store, Product, ProductToBuy, Reservation, ReservationError, CartError, PRODUCT_LISTING, integer
 #Flask JWT Extended 
-from flask_jwt_extended import create_access_token, JWTManager
+from flask_jwt_extended import create_access_token
 #from flask_appbuilder.api import BaseApi, expose
 
 #from models import Person
@@ -20,12 +30,27 @@ app = Flask(__name__)
 app.url_map.strict_slashes = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config["JWT_SECRET_KEY"] = "317fc45bf08126c37f6cb1fd14bcdc9b"
-MIGRATE = Migrate(app, db)
 db.init_app(app)
+# Flask-Migrate (and Alembic) are only loaded by the flask command, the web workers never run migrations
+if click.get_current_context(silent=True) is not None:
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
 CORS(app)
-setup_admin(app)
-jwt = JWTManager(app)
+setup_lazy_admin(app)
+setup_metrics(app)
+# After the metrics, so they record the size of the compressed responses
+setup_compression(app)
+jwt = setup_auth(app)
+with app.app_context():
+    set_mysql_statement_timeout(db.engine)
+
+PRODUCTS_PAGE_SIZE = 20
+PRODUCTS_MAX_PAGE_SIZE = 100
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+IMPORT_MAX_BATCH_SIZE = 10000
+RESERVATION_TTL_SECONDS = int(os.environ.get('RESERVATION_TTL_SECONDS', 900))
 
 
 # Handle/serialize errors like a JSON object
@@ -39,39 +64,47 @@ def handle_invalid_usage(error):
 
 # generate sitemap with all your endpoints
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Return the metrics of the endpoints and the database connection pool in the Prometheus text format """
+    return Response(
+        request_metrics.render() + pool_metrics(db.engine.pool), mimetype="text/plain; version=0.0.4"
+    )
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """ Return the hit/miss counters of the response cache """
+    return jsonify(cache.stats()), 200
+
 #----------------------------SIGNUP BUYER AND SELLER----------------------
 
 @app.route('/signup-buyer',  methods=['POST'])
 def register_buyer():
     """ Recive data to create a Buyer """
     request_body = request.json 
-    print(request.data)
-    print(request.json)
-    new_user = User.create(
-        email = request_body["email"],
-        password = request_body["password"]
-    )
-
-    if not isinstance(new_user, User):
-        return jsonify({
-            "msg": "ocurrió un problea al crear el Usuario"
-        }), 500
-    new_user.save()
-
-    new_buyer = Buyer.create(
-        first_name = request_body["first_name"],
-        last_name = request_body["last_name"],
-        id_number = request_body["id_number"],
-        cellphone_number = request_body["cellphone_number"],
-        address = request_body["address"],
-        user_id = new_user.id
-    )
-    if not isinstance(new_buyer, Buyer):
-        return jsonify({
-            "msg": "ocurrió un problea al crear el Usuario"
-        }), 500
-
-    new_buyer.save()
+    # The user and the buyer are committed together, or none of them if something fails
+    with Crud.transaction():
+        new_user = User.create(
+            email = request_body["email"],
+            password = request_body["password"]
+        )
+
+        if not isinstance(new_user, User):
+            raise APIException("ocurrió un problea al crear el Usuario", status_code=500)
+        new_user.save(commit=False)
+
+        new_buyer = Buyer.create(
+            first_name = request_body["first_name"],
+            last_name = request_body["last_name"],
+            id_number = request_body["id_number"],
+            cellphone_number = request_body["cellphone_number"],
+            address = request_body["address"],
+            user_id = new_user.id
+        )
+        if not isinstance(new_buyer, Buyer):
+            raise APIException("ocurrió un problea al crear el Usuario", status_code=500)
+
+        new_buyer.save(commit=False)
 
     return jsonify({
         "msg": "El usuario fue creado satisfactoriamente.",
@@ -84,47 +117,39 @@ def register_seller():
     """ Recibe data to create an User and assign it to a seller, creating one """
     request_body = request.json
 
-    #Create an user
-    new_user = User(
-        email =  request_body["email"],
-        password = request_body["password"],
-    )
-    if not isinstance(new_user, User):
-        return jsonify(
-            {
-                "msg": "Ocurrió un problema al crear el usuario."
-            }
-        ), 500
-    new_user.save()
-
-    #Create seller role
-    seller = Seller.create(
-        company_name = request_body["company_name"],
-        identification_number = request_body["identification_number"],
-        cellphone_number = request_body["cellphone_number"],
-        user_id = new_user.id
-    )
-    if not isinstance(seller, Seller):
-        #User.query.filter_by(id= user.id).delete()
-        #db.session.commit()
-        return jsonify({
-            "msg" : "Ocurrió un error creando el rol de vendedor"
-        }), 500
-
-    seller.save()
-
+    # The user, the seller and the store are committed together, or none of them if something fails
+    with Crud.transaction():
+        #Create an user
+        new_user = User(
+            email =  request_body["email"],
+            password = request_body["password"],
+        )
+        if not isinstance(new_user, User):
+            raise APIException("Ocurrió un problema al crear el usuario.", status_code=500)
+        new_user.save(commit=False)
+
+        #Create seller role
+        seller = Seller.create(
+            company_name = request_body["company_name"],
+            identification_number = request_body["identification_number"],
+            cellphone_number = request_body["cellphone_number"],
+            user_id = new_user.id
+        )
+        if not isinstance(seller, Seller):
+            raise APIException("Ocurrió un error creando el rol de vendedor", status_code=500)
+
+        seller.save(commit=False)
+
+        #Create Store
+        store = Store.create(
+            name = request_body['name'],
+            description = request_body["description"],
+            seller_id = seller.id
+        )
+        if not isinstance(store, Store):
+            raise APIException("Ocurrió un problema al crear la tienda", status_code=500)
+        store.save(commit=False)
 
-    #Create Store
-    store = Store.create(
-        name = request_body['name'],
-        description = request_body["description"],
-        seller_id = seller.id
-    )
-    if not isinstance(store, Store):
-        return jsonify({
-            "msg" : "Ocurrió un problema al crear la tienda"
-        }), 500
-    store.save()
     return jsonify({
         "msg": "La cuenta fue creada satisfactoriamente",
         "response": {
@@ -143,7 +168,7 @@ def log_user_in():
     
     """
     data = request.json
-    user = User.query.filter_by(email = data.get('email')).one_or_none()
+    user = User.get_by_email(data.get('email'))
     if user is None:
         return jsonify({
             "msg" : "El usuario no existe"
@@ -152,41 +177,76 @@ def log_user_in():
         return jsonify({
             "msg" : "Malas credenciales"
         }), 404
-    #Create token
-    token = create_access_token(identity=user.id)
-
+    if user.password_needs_rehash():
+        # The hashing method or its cost changed, upgrade the hash while we have the password
+        user.set_password(data.get('password'))
+        user.save()
     user_role = user.role
+    #Create token, with the role so other endpoints don't have to look it up. The subject of a JWT must be a string
+    token = create_access_token(identity=str(user.id), additional_claims={"role": user_role})
+
     return jsonify({
         "user": user.serialize(),
         "role": user_role,
         "jwt": token
     }), 201
 
+@app.route('/logout', methods=['POST'])
+@login_required
+def log_user_out():
+    """ Revoke the token of the request, it can't be used again """
+    revoke_current_token()
+    return jsonify({
+        "msg": "La sesión fue cerrada"
+    }), 200
+
 
 #----------------------------BUYER ENDPOINTS-------------------------
 
 @app.route('/buyers', methods=['GET'])
 def get_buyers():
-    """Get all the buyers """
-    buyers = Buyer.get_all()
-    buyers_dict = list(map(lambda buyer: buyer.serialize(), buyers))
-    return jsonify({
-        "buyers": buyers_dict
+    """Get all the buyers, streamed with ?stream=true """
+    if wants_stream():
+        return stream_json_list("buyers", BUYER_SCHEMA.query(Buyer.query), BUYER_SCHEMA.build)
+    return json_response({
+        "buyers": BUYER_SCHEMA.all(Buyer.query)
     })
 
 
 #----------------------------CATEGORY ENDPOINTS------------------------
 
 @app.route('/categories', methods=['GET'])
+# The listing version is the one of the category index, read here with the others
+@conditional(Category, Product, PRODUCT_LISTING)
 def get_categories():
-    """ Get all the categories available """
-    categories = Category.get_all()
-    categories_dict = list(map(lambda category: category.serialize(), categories))
-    return jsonify(
-        {
-            "categories" : categories_dict
-        }
-    )
+    """ Get all the categories available, with the number of available products and of stores selling them.
+        Query params (optional):
+            include: products to add the first page of available products of every category
+            limit: size of that page, default 20, max 100. The next_cursor of a category continues
+                   in /products?category_id=<id>&cursor=<next_cursor>
+    """
+    include = request.args.get('include')
+    if include is None:
+        return json_response({"categories": category_index.categories()}, 200)
+    if include != "products":
+        raise APIException("include solo puede ser products", status_code=400)
+    limit = query_param('limit', int, PRODUCTS_PAGE_SIZE)
+    if limit < 1 or limit > PRODUCTS_MAX_PAGE_SIZE:
+        raise APIException(f"limit debe estar entre 1 y {PRODUCTS_MAX_PAGE_SIZE}", status_code=400)
+
+    def serialize_categories():
+        # One extra product per category tells if it has a next page
+        categories = category_index.categories()
+        products = Product.get_first_by_category(
+            [category["id"] for category in categories if category["product_count"]], limit + 1
+        )
+        for category in categories:
+            category_products = products.get(category["id"], [])
+            category["next_cursor"] = category_products[limit - 1]["id"] if len(category_products) > limit else None
+            category["products"] = category_products[:limit]
+        return {"categories": categories}
+
+    return cached_json_response(f"categories:products:{limit}", (Category, Product), serialize_categories)
 
 @app.route('/new-category', methods=['POST'])
 def create_category():
@@ -207,9 +267,9 @@ def create_category():
 @app.route('/<int:seller_id>/store', methods=['GET'])
 def get_store(seller_id):
     """ Get a specific store by id """
-    store_id = Store.query.filter_by(seller_id = seller_id).one_or_none()
-    print(store_id)
-    store = Store.get_by_id(store_id.id)
+    store = Store.get_by_seller(seller_id)
+    if store is None:
+        raise APIException("La tienda no existe", status_code=404)
     return jsonify(
         {
             "store" : store.serialize()
@@ -234,46 +294,124 @@ def create_store():
     ), 201
 
 @app.route('/stores', methods=['GET'])
+@conditional(Store, Product, Category)
 def get_stores():
-    """ Return all the stores available """
-    stores = Store.get_all()
-    return jsonify({
-        "stores": [ store.serialize() for store in stores ]
-    }), 200
+    """ Return all the stores available, streamed with ?stream=true """
+    if wants_stream():
+        # In batches of stores, the summaries query can't run while a server side cursor is open
+        stores = Store.iter_with_summaries(STREAM_BATCH_SIZE)
+        return stream_json_list("stores", stores, lambda store_summary: store_summary[0].serialize(store_summary[1]))
+
+    def serialize_stores():
+        summaries = Store.get_summaries()
+        return {
+            "stores": [ store.serialize(summaries.get(store.id)) for store in Store.get_all() ]
+        }
+
+    return cached_json_response("stores", (Store, Product, Category), serialize_stores)
 
 #------------------------------PRODUCT ENDPOINTS--------------------
 
 @app.route('/products', methods=['GET'])
+@conditional(Product, Category)
 def get_active_products():
-    """ Return all the active products available """
-    active_products = Product.get_all_available()
+    """ Return a page of the active products available.
+        Query params (all optional):
+            limit: page size, default 20, max 100
+            cursor: the next_cursor returned by the previous page
+            category_id, store_id: filter by category or store
+            min_price, max_price: filter by price range
+            sort: id (default), price or -price for the most expensive first
+            stream: true to stream every product after the cursor instead of a page
+    """
+    limit = query_param('limit', int, PRODUCTS_PAGE_SIZE)
+    if limit < 1 or limit > PRODUCTS_MAX_PAGE_SIZE:
+        raise APIException(f"limit debe estar entre 1 y {PRODUCTS_MAX_PAGE_SIZE}", status_code=400)
+    sort = request.args.get('sort', 'id')
+    if sort not in Product.SORTS:
+        raise APIException(f"sort debe ser uno de {', '.join(Product.SORTS)}", status_code=400)
+    filters = dict(
+        sort = sort,
+        cursor = query_param('cursor', lambda cursor: Product.parse_cursor(cursor, sort)),
+        category_id = query_param('category_id', integer),
+        store_id = query_param('store_id', integer),
+        min_price = query_param('min_price', Product.price_bound),
+        max_price = query_param('max_price', Product.price_bound)
+    )
+
+    if wants_stream():
+        return stream_json_list("products", PRODUCT_SCHEMA.query(Product.get_available(**filters)), PRODUCT_SCHEMA.build)
+
+    def serialize_page():
+        active_products, next_cursor = Product.get_page(limit, PRODUCT_SCHEMA, **filters)
+        return {
+            "products": active_products,
+            "next_cursor": next_cursor
+        }
+
+    cache_key = f"products:{limit}:" + ":".join(str(value) for value in filters.values())
+    return cached_json_response(cache_key, (Product, Category), serialize_page)
+
+@app.route('/products/search', methods=['GET'])
+def search_active_products():
+    """ Search the active products by name and description, the most relevant first.
+        Query params:
+            q: the words to search
+            category_id, store_id: filter by category or store (optional)
+            page: page number, default 1 (optional)
+            limit: page size, default 20, max 100 (optional)
+        Return the products, the next page if there is one, and the matches per category and store
+    """
+    terms = request.args.get('q', '').strip()
+    if not terms:
+        raise APIException("El parámetro q es obligatorio", status_code=400)
+    page = query_param('page', integer, 1)
+    limit = query_param('limit', int, PRODUCTS_PAGE_SIZE)
+    if page < 1 or limit < 1 or limit > PRODUCTS_MAX_PAGE_SIZE:
+        raise APIException(f"page debe ser positivo y limit estar entre 1 y {PRODUCTS_MAX_PAGE_SIZE}", status_code=400)
+    products, has_next, facets = search_products(
+        terms,
+        category_id = query_param('category_id', integer),
+        store_id = query_param('store_id', integer),
+        page = page,
+        limit = limit
+    )
     return jsonify({
-        "products": [ product.serialize() for product in active_products ]
+        "products": [ product.serialize() for product in products ],
+        "next_page": page + 1 if has_next else None,
+        "facets": facets
     }), 200
 
 @app.route('/stores/<int:store_id>/products', methods=['GET'])
+@conditional(Product, Category)
 def get_all_products(store_id):
-    """ Get all the poducts in a specific Store by store_id"""
-    products = Product.get_by_store(store_id)
-    products_dict = list(map(lambda product: product.serialize(), products))
-    print(products_dict)
-    return jsonify(
+    """ Get all the poducts in a specific Store by store_id, streamed with ?stream=true """
+    if wants_stream():
+        return stream_json_list(
+            "products", PRODUCT_SCHEMA.query(Product.get_by_store(store_id)), PRODUCT_SCHEMA.build, store_id=store_id
+        )
+    return json_response(
         {
             "store_id" : store_id, 
-            "products" : products_dict
-        }
-    ), 200
+            "products" : PRODUCT_SCHEMA.all(Product.get_by_store(store_id))
+        }, 200
+    )
     
 
 @app.route('/stores/<int:store_id>/new-product', methods=['POST'])
+@seller_required
 def new_product(store_id):
     """Create a new Product for a specific Store by store id """
     request_body = request.json
+    try:
+        price = Product.valid_price(request_body.get("price"))
+    except ValueError as error:
+        raise APIException(str(error), status_code=400)
     new_product = Product.create(
         name = request_body["name"],
         description = request_body["description"],
-        price = request_body["price"],
-        amount_available = request_body['amount_available'],
+        price = price,
+        amount_available = body_field(request_body, 'amount_available', int),
         store_id = store_id,
         active = request_body['active'],
         img_url = request_body['img_url'],
@@ -287,9 +425,33 @@ def new_product(store_id):
         }
     ), 201
 
+@app.route('/stores/<int:store_id>/import-products', methods=['POST'])
+@seller_required
+def import_store_products(store_id):
+    """ Create many Products for a specific Store from a CSV (text/csv) or NDJSON (application/x-ndjson) body.
+        Every row/line has the fields of new-product:
+            name,description,price,amount_available,active,img_url,category_id
+        Query params (optional):
+            batch_size: rows inserted per commit
+        Return how many rows were imported and the errors of the rows that were not
+    """
+    if request.mimetype not in CSV_CONTENT_TYPES + NDJSON_CONTENT_TYPES:
+        raise APIException("El cuerpo debe ser text/csv o application/x-ndjson", status_code=415)
+    if Store.query.get(store_id) is None:
+        raise APIException("La tienda no existe", status_code=404)
+    batch_size = query_param('batch_size', int, IMPORT_BATCH_SIZE)
+    if batch_size < 1 or batch_size > IMPORT_MAX_BATCH_SIZE:
+        raise APIException(f"batch_size debe estar entre 1 y {IMPORT_MAX_BATCH_SIZE}", status_code=400)
+    report = import_products(request.stream, request.mimetype, store_id, batch_size)
+    return jsonify({
+        "msg" : "La importación terminó",
+        "report" : report
+    }), 200
+
 
 #-------------------PRODUCT TO BUY -------------------
 @app.route('/<int:buyer_id>/products-to-buy', methods=['GET'])
+@buyer_required
 def get_products_buyer(buyer_id):
     """ Get all the products to buy from a buyer """
     products = ProductToBuy.get_all_by_buyer_id(buyer_id)
@@ -301,20 +463,35 @@ def get_products_buyer(buyer_id):
 
 
 
+@app.route('/<int:buyer_id>/cart', methods=['GET'])
+@buyer_required
+def get_cart_summary(buyer_id):
+    """ Return the products of the cart of a buyer with the total of every line, the subtotal per store and the total """
+    return json_response(ProductToBuy.get_summary(buyer_id), 200)
+
 @app.route('/add-product', methods=['POST'])
+@buyer_required
 def create_poduct_to_buy():
-    """ Create a product to buy
+    """ Create a product to buy in the cart of the buyer of the token
         Request body example:
         {
             "buyer_id" : "2",
             "product_id" : "4",
             "quantity" : "1"
         }
+        buyer_id is optional, if it is sent it must be the buyer of the token
      """
     request_body =  request.json
+    buyer_id = current_principal().buyer_id
+    if 'buyer_id' in request_body and body_field(request_body, 'buyer_id', int) != buyer_id:
+        raise APIException("No tiene permiso sobre este carrito", status_code=403)
+    try:
+        quantity = ProductToBuy.valid_quantity(request_body.get('quantity'))
+    except CartError as error:
+        raise APIException(str(error), status_code=400)
     product_to_buy = ProductToBuy.create(
-        quantity = request_body['quantity'],
-        buyer_id = request_body['buyer_id'],
+        quantity = quantity,
+        buyer_id = buyer_id,
         product_id = request_body['product_id']
     )
     if not isinstance(product_to_buy, ProductToBuy):
@@ -328,6 +505,7 @@ def create_poduct_to_buy():
     }), 201
 
 @app.route('/edit-product-to-buy/<int:id>', methods=['PATCH'])
+@buyer_required
 def edit_product_to_buy(id):
     """ Edit a existent product quantity.
         request body example
@@ -336,20 +514,98 @@ def edit_product_to_buy(id):
         }
     """
     request_body = request.json
-    ProductToBuy.edit_quantity(id, request_body['quantity'])
+    try:
+        quantity = ProductToBuy.valid_quantity(request_body.get('quantity'))
+    except CartError as error:
+        raise APIException(str(error), status_code=400)
+    if not ProductToBuy.edit_quantity(id, quantity, current_principal().buyer_id):
+        raise APIException("El producto a comprar no existe", status_code=404)
     return jsonify({
         "msg" : "El producto fue actualizado satisfactoriamente"
     }), 200
 
 @app.route('/product-to-delete/<int:id>', methods=['DELETE'])
+@buyer_required
 def delete_product_to_buy(id):
-    """ Delete a product to buy by id """
-    ProductToBuy.delete_by_id(id)
+    """ Delete a product to buy of the cart of the buyer by id """
+    if not ProductToBuy.delete_from_cart(id, current_principal().buyer_id):
+        raise APIException("El producto a comprar no existe", status_code=404)
     return jsonify({
         "msg": "Product eliminated successfully"
     }), 200
 
+@app.route('/<int:buyer_id>/cart', methods=['POST'])
+@buyer_required
+def edit_cart(buyer_id):
+    """ Add, update and delete many products to buy of a buyer at once, all or none of them.
+        Return the resulting cart.
+        Request body example:
+        {
+            "operations": [
+                { "op": "add", "product_id": 4, "quantity": 1 },
+                { "op": "update", "id": 7, "quantity": 3 },
+                { "op": "delete", "id": 8 }
+            ]
+        }
+    """
+    operations = (request.json or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        raise APIException("operations debe ser una lista de operaciones", status_code=400)
+    try:
+        ProductToBuy.apply_batch(buyer_id, operations)
+    except CartError as error:
+        raise APIException(str(error), status_code=400)
+    products = ProductToBuy.get_all_by_buyer_id(buyer_id)
+    return jsonify({
+        "msg": "El carrito fue actualizado",
+        "products_to_buy" : [ product_to_buy.serialize() for product_to_buy in products ]
+    }), 200
+
+#-------------------RESERVATIONS AND CHECKOUT -------------------
+@app.route('/<int:buyer_id>/reserve', methods=['POST'])
+@buyer_required
+def reserve_cart(buyer_id):
+    """ Hold the stock of every product in the cart of the buyer until it checks out or the reservation expires """
+    try:
+        reservations = Reservation.reserve_cart(buyer_id, RESERVATION_TTL_SECONDS)
+    except ReservationError as error:
+        raise APIException(str(error), status_code=409)
+    return jsonify({
+        "msg": "El stock fue reservado",
+        "reservations": [ reservation.serialize() for reservation in reservations ]
+    }), 201
+
+@app.route('/<int:buyer_id>/checkout', methods=['POST'])
+@buyer_required
+def checkout_cart(buyer_id):
+    """ Buy the reserved products of the cart of the buyer """
+    try:
+        order = Reservation.checkout(buyer_id)
+    except ReservationError as error:
+        raise APIException(str(error), status_code=409)
+    return jsonify({
+        "msg": "La compra fue realizada",
+        "products": [ {"product_id": line.product_id, "quantity": line.quantity} for line in order.lines ],
+        "order": order.serialize()
+    }), 200
+
   
+@app.cli.command("create-search-index")
+def create_search_index_command():
+    """ Create the full text index of the products on an existing database """
+    with db.engine.begin() as connection:
+        create_search_index(connection)
+
+@app.cli.command("upgrade-typed-columns")
+def upgrade_typed_columns_command():
+    """ Convert the price, stock and cart quantities of an existing database to numbers and add the missing constraints and indexes """
+    try:
+        with db.engine.begin() as connection:
+            converted = upgrade_typed_columns(connection)
+    except ConversionError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"Upgraded: {', '.join(converted) or 'nothing, the columns were already numbers with their constraints'}")
+
 # this only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
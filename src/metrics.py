@@ -0,0 +1,121 @@
+"""
+Per endpoint performance metrics: wall time, number of SQL statements, time spent
+in SQL and response size of every request, kept as histograms by route and
+exported in the Prometheus text format.
+
+Statements slower than SLOW_QUERY_MS milliseconds (default 200) are logged.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+logger = logging.getLogger("slow_queries")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram(object):
+    """ Cumulative histogram of the observations of one series """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestMetrics(object):
+    """ Histograms by metric and (method, route) """
+
+    METRICS = {
+        "http_request_duration_seconds": ("Wall time of the request", SECONDS_BUCKETS),
+        "http_request_sql_queries": ("SQL statements run by the request", QUERIES_BUCKETS),
+        "http_request_sql_seconds": ("Time the request spent running SQL", SECONDS_BUCKETS),
+        "http_response_size_bytes": ("Size of the response body", BYTES_BUCKETS),
+    }
+
+    def __init__(self):
+        self.series = {name: {} for name in self.METRICS}
+        self._lock = threading.Lock()
+
+    def observe(self, name, key, value):
+        with self._lock:
+            histogram = self.series[name].get(key)
+            if histogram is None:
+                histogram = self.series[name][key] = Histogram(self.METRICS[name][1])
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (description, _) in self.METRICS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for (method, route), histogram in sorted(self.series[name].items()):
+                    lines += histogram.render(name, f'method="{method}",route="{route}"')
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+def record_request(response):
+    if "request_start" not in g:
+        return response
+    key = (request.method, request.url_rule.rule if request.url_rule else "unmatched")
+    request_metrics.observe("http_request_duration_seconds", key, time.perf_counter() - g.request_start)
+    request_metrics.observe("http_request_sql_queries", key, g.sql_queries)
+    request_metrics.observe("http_request_sql_seconds", key, g.sql_seconds)
+    # Streamed responses have no length yet, their size is not recorded
+    if response.content_length is not None:
+        request_metrics.observe("http_response_size_bytes", key, response.content_length)
+    return response
+
+def setup_metrics(app):
+    """ Record the metrics of every request of the app """
+    app.before_request(start_request)
+    app.after_request(record_request)
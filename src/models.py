@@ -1,24 +1,79 @@
 from flask_sqlalchemy import SQLAlchemy
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload, selectinload
+from passwords import hash_password, verify_password, needs_rehash
 
 db = SQLAlchemy()
 
+def invalidate_tables(*tablenames):
+    """ After a commit, bump the version of the tables written so cached responses and ETags built from them go stale.
+        The sessions do it on commit for the tables they wrote (see track_writes)
+    """
+    TableVersion.bump(*tablenames)
+
+def track_writes(session, *tablenames):
+    """ Bump the versions of the tables when the session commits. The flushes and the INSERT, UPDATE and DELETE
+        statements run through the session are tracked by the events at the end of this module,
+        the bulk_insert_mappings and bulk_update_mappings have to be tracked with this.
+        Only the VERSIONED_TABLES have a version, the writes to the others are not tracked.
+    """
+    versioned = VERSIONED_TABLES.intersection(tablenames)
+    if versioned:
+        session.info.setdefault("written_tables", set()).update(versioned)
+
+# Version of the product columns the category counts read (see category_index.py), bumped with the product
+# table except by the writes that change none of them, like the stock taken by every reservation
+PRODUCT_LISTING = "product_listing"
+PRODUCT_LISTING_COLUMNS = frozenset(("active", "category_id", "store_id"))
+
+# The versions something reads: the catalog ETags and cached bodies (see conditional.py), the category index
+# and the revoked tokens (see auth.py). A commit that only writes other tables, like the carts, the orders
+# and the signups, doesn't run a second transaction to bump versions nobody reads.
+VERSIONED_TABLES = frozenset(("product", "category", "store", "revoked_token", PRODUCT_LISTING))
+
+# Range of the Integer columns on every database
+MIN_INTEGER, MAX_INTEGER = -2**31, 2**31 - 1
+
+def integer(value):
+    """ Return the value as an integer, raise ValueError if it is not a whole number or doesn't fit an Integer column.
+        int() alone would truncate 1.7 to 1 and take true for 1
+    """
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    if not MIN_INTEGER <= int(value) <= MAX_INTEGER:
+        raise ValueError(value)
+    return int(value)
+
 class Crud(object):
     @classmethod
     def create(cls, **kwargs):
         """ Create and return an instance """
         return cls(**kwargs)
 
+    @classmethod
+    def load_options(cls):
+        """ Loader options with the relationships serialize() needs, to avoid a query per row """
+        return ()
+
+    @classmethod
+    def loaded_query(cls):
+        """ Return a query that eager loads what serialize() needs """
+        return cls.query.options(*cls.load_options())
+
     @classmethod
     def get_all(cls):
         """ Get all the elements from the table """
-        return cls.query.all()
+        return cls.loaded_query().all()
 
     @classmethod
     def get_by_id(cls, id):
         """ Return a specific instance from the table """
-        return cls.query.get(id)
+        return cls.loaded_query().get(id)
 
     @classmethod
     def delete_by_id(cls, id):
@@ -27,6 +82,28 @@ class Crud(object):
         db.session.delete(to_delete)
         db.session.commit()
 
+    def save(self, commit=True):
+        """ Save and commit a new instance.
+            With commit=False it is only flushed, to get its id, and committed by the enclosing Crud.transaction()
+        """
+        db.session.add(self)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+        return self
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """ Commit everything saved with save(commit=False) in the block at once, or roll it back if the block fails """
+        try:
+            yield db.session
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
 
 class User(db.Model, Crud):
     id = db.Column(db.Integer, primary_key=True)
@@ -37,11 +114,38 @@ class User(db.Model, Crud):
     user_seller = db.relationship("Seller", backref="user", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
     user_buyer = db.relationship("Buyer", backref="user", cascade="all, delete-orphan", passive_deletes=True, uselist=False)
 
+    @classmethod
+    def load_options(cls):
+        return (joinedload(cls.user_seller), joinedload(cls.user_buyer))
+
+    @classmethod
+    def get_by_email(cls, email):
+        """ Get a user by email with its seller and buyer, in one query """
+        return cls.loaded_query().filter_by(email = email).one_or_none()
+
+    @classmethod
+    def get_access(cls, id):
+        """ Return what the user may act as: whether it is active, its buyer id, its seller id and the ids of its stores,
+            in one query. None if the user doesn't exist
+        """
+        rows = db.session.query(cls.is_active, Buyer.id, Seller.id, Store.id).outerjoin(
+            Buyer, Buyer.user_id == cls.id
+        ).outerjoin(Seller, Seller.user_id == cls.id).outerjoin(
+            Store, Store.seller_id == Seller.id
+        ).filter(cls.id == id).all()
+        if not rows:
+            return None
+        is_active, buyer_id, seller_id, _ = rows[0]
+        return {
+            "is_active": is_active,
+            "buyer_id": buyer_id,
+            "seller_id": seller_id,
+            "store_ids": frozenset(store_id for _, _, _, store_id in rows if store_id is not None)
+        }
+
     @property
     def role(self): 
-        seller = Seller.query.filter_by(user_id = self.id).one_or_none()
-        if seller is None:
-            buyer = Buyer.query.filter_by(user_id = self.id).one_or_none()
+        if self.user_seller is None:
             return "buyer"
         return "seller"
 
@@ -54,16 +158,20 @@ class User(db.Model, Crud):
 
     def set_password(self, password):
         """ Create a hashed password """
-        self.hashed_password = generate_password_hash(
+        self.hashed_password = hash_password(
             f"{password}{self.salt}"
         )
 
     def check_password(self, password):
-        return check_password_hash(
+        return verify_password(
             self.hashed_password, 
             f"{password}{self.salt}"
         )
 
+    def password_needs_rehash(self):
+        """ Return True if the password was hashed with other method or cost than the configured ones """
+        return needs_rehash(self.hashed_password)
+
     def __repr__(self):
         return '<User %r>' % self.email
 
@@ -77,12 +185,6 @@ class User(db.Model, Crud):
             # do not serialize the password, its a security breach
         }
 
-    def save(self):
-        """ Save and commit a new User """
-        db.session.add(self)
-        db.session.commit()
-        return self
-
 class Buyer(db.Model, Crud):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(120), unique=False, nullable=False)
@@ -90,15 +192,10 @@ class Buyer(db.Model, Crud):
     id_number = db.Column(db.String(12), unique=True, nullable=False)
     cellphone_number = db.Column(db.String(30), unique=False, nullable=False)
     address = db.Column(db.String(80), unique=False, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True, index=True)
     product_to_buy = db.relationship('ProductToBuy', backref='buyer')
     #shopping_car = db.relationship('ShoppingCar', backref='buyer')
 
-    def save(self):
-        """ Save and commit a new Buyer """
-        db.session.add(self)
-        db.session.commit()
-
     def __repr__(self):
         return '<Buyer %r>' % self.first_name
 
@@ -117,12 +214,7 @@ class Seller(db.Model, Crud):
     company_name = db.Column(db.String(250), nullable=False, unique=True)
     identification_number = db.Column(db.String(250), nullable=False, unique=True)
     cellphone_number = db.Column(db.String(250), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True)
-
-    def save(self):
-        """ Save and commit a new Seller """
-        db.session.add(self)
-        db.session.commit()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True, index=True)
 
     def __repr__(self):
         return '<Seller %r>' % self.company_name
@@ -141,10 +233,9 @@ class Category(db.Model, Crud):
     name = db.Column(db.String(120), unique=True, nullable=False)
     products = db.relationship('Product', backref='category')
 
-    def save(self):
-        """ Save and commit a new Category """
-        db.session.add(self)
-        db.session.commit()
+    @classmethod
+    def load_options(cls):
+        return (selectinload(cls.products),)
 
     def __repr__(self):
         return '<Categroy %r>' % self.name
@@ -167,59 +258,203 @@ class Store(db.Model, Crud):
     name = db.Column(db.String(120), unique=True, nullable=False)
     description = db.Column(db.String(120), unique=False, nullable=False)
     categories = db.Column(db.Integer, db.ForeignKey('category.id'))
-    seller_id = db.Column(db.Integer, db.ForeignKey('seller.id'))
+    seller_id = db.Column(db.Integer, db.ForeignKey('seller.id'), index=True)
     products = db.relationship('Product', backref='store')
 
-    def save(self):
-        """ Save and commit a new Store """
-        db.session.add(self)
-        db.session.commit()
+    @classmethod
+    def get_summaries(cls, store_ids=None):
+        """ Return a dictionary store_id -> products summary of the stores,
+            counting products and distinct categories in the database with one grouped query
+        """
+        # Start from the stores so the ones without products get a summary too
+        query = db.session.query(
+            cls.id, Category.id, Category.name, db.func.count(Product.id)
+        ).outerjoin(Product, Product.store_id == cls.id).outerjoin(
+            Category, Product.category_id == Category.id
+        ).group_by(cls.id, Category.id, Category.name).order_by(cls.id, Category.id)
+        if store_ids is not None:
+            query = query.filter(cls.id.in_(store_ids))
+        summaries = {}
+        for store_id, category_id, category_name, quantity in query:
+            summary = summaries.setdefault(store_id, {"quantity": 0, "categories": []})
+            summary["quantity"] += quantity
+            if category_id is not None:
+                summary["categories"].append({"id": category_id, "name": category_name})
+        return summaries
 
+    @classmethod
+    def iter_with_summaries(cls, batch_size):
+        """ Yield (store, summary) for every store ordered by id, reading batch_size stores and
+            their summaries at a time so memory doesn't grow with the number of stores
+        """
+        last_id = 0
+        while True:
+            stores = cls.loaded_query().filter(cls.id > last_id).order_by(cls.id).limit(batch_size).all()
+            if not stores:
+                return
+            summaries = cls.get_summaries([store.id for store in stores])
+            for store in stores:
+                yield store, summaries.get(store.id)
+            last_id = stores[-1].id
+
+    @classmethod
+    def get_by_seller(cls, seller_id):
+        """ Get the store of a seller """
+        return cls.loaded_query().filter_by(seller_id = seller_id).one_or_none()
 
     def __repr__(self):
         """ Return a representancion of the instance """
         return '<Store %r>' % self.name
 
-    def serialize(self):
-        """ Return a dictionary of the instance """
+    def serialize(self, summary=None):
+        """ Return a dictionary of the instance, summary is the entry of Store.get_summaries for this store """
+        if summary is None:
+            summary = Store.get_summaries([self.id]).get(self.id)
         return {
             "id" : self.id,
             "name" : self.name,
             "description" : self.description,
             "seller_id" : self.seller_id,
-            "products" : {
-                "quantity": len(self.products),
-                "categories" : [c.category.minialize() for c in self.products],
-            }
+            "products" : summary or {"quantity": 0, "categories": []}
         }
 
+# SQLite takes up to 500 SELECTs in a UNION ALL
+FIRST_BY_CATEGORY_CHUNK = 200
+
 class Product(db.Model, Crud):
+    __table_args__ = (
+        db.Index('ix_product_active_id', 'active', 'id'),
+        db.Index('ix_product_active_category_id', 'active', 'category_id', 'id'),
+        db.Index('ix_product_active_store_id', 'active', 'store_id', 'id'),
+        db.Index('ix_product_active_price_id', 'active', 'price', 'id'),
+    )
+    SORTS = ("id", "price", "-price")
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.String(240), nullable=False)
-    price = db.Column(db.String(80), nullable=False)
-    amount_available = db.Column(db.String(80), nullable=False)
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    amount_available = db.Column(db.Integer, nullable=False)
     active = db.Column(db.Boolean, nullable=False)
     img_url = db.Column(db.String(360), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
-    store_id = db.Column(db.Integer, db.ForeignKey('store.id'))
+    # The indexes starting with active serve the listings, these the joins and the lookups by store or category
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), index=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), index=True)
     product_to_buy = db.relationship('ProductToBuy', backref='product')
 
+    @classmethod
+    def load_options(cls):
+        return (joinedload(cls.category),)
+
     @classmethod
     def get_by_store(cls, store_id):
         """ Get all the poducts in a store """
         return cls.query.filter_by(store_id = store_id)
 
     @classmethod
-    def get_all_available(cls):
-        """ get all the available products"""
-        return cls.query.filter_by(active = True).all()
+    def get_available(cls, cursor=None, category_id=None, store_id=None, min_price=None, max_price=None, sort="id"):
+        """ Return a query of the available products after the cursor, ordered by sort (one of SORTS).
+            The cursor is the last id seen, or the (price, id) of the last product seen when sorting by price.
+        """
+        query = cls.query.filter_by(active = True)
+        if category_id is not None:
+            query = query.filter_by(category_id = category_id)
+        if store_id is not None:
+            query = query.filter_by(store_id = store_id)
+        if min_price is not None:
+            query = query.filter(cls.price >= min_price)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        if sort == "id":
+            if cursor is not None:
+                query = query.filter(cls.id > cursor)
+            return query.order_by(cls.id)
+        # The id breaks the ties between equal prices, so the cursor is a position in a total order
+        if sort == "price":
+            if cursor is not None:
+                query = query.filter(db.tuple_(cls.price, cls.id) > cursor)
+            return query.order_by(cls.price, cls.id)
+        if cursor is not None:
+            query = query.filter(db.tuple_(cls.price, cls.id) < cursor)
+        return query.order_by(cls.price.desc(), cls.id.desc())
 
-    
-    def save(self):
-        """ Save and commit a new Product """
-        db.session.add(self)
-        db.session.commit()
+    @classmethod
+    def get_first_by_category(cls, category_ids, limit):
+        """ Return a dictionary category_id -> the first limit available products of the categories, minialized.
+            Every category is a LIMIT query that reads its first rows of ix_product_active_category_id and stops,
+            they are sent together joined with UNION ALL, FIRST_BY_CATEGORY_CHUNK categories per statement
+        """
+        products = {}
+        category_ids = list(category_ids)
+        for start in range(0, len(category_ids), FIRST_BY_CATEGORY_CHUNK):
+            pages = [
+                db.session.query(cls.category_id, cls.id, cls.name).filter(
+                    cls.active == True, cls.category_id == category_id
+                ).order_by(cls.id).limit(limit).subquery()
+                for category_id in category_ids[start:start + FIRST_BY_CATEGORY_CHUNK]
+            ]
+            query = db.union_all(*[db.select([page]) for page in pages]) if len(pages) > 1 else db.select([pages[0]])
+            for category_id, id, name in db.session.execute(query):
+                products.setdefault(category_id, []).append({"id": id, "name": name})
+        # UNION ALL doesn't keep the order of its parts
+        for page in products.values():
+            page.sort(key=lambda product: product["id"])
+        return products
+
+    @staticmethod
+    def parse_cursor(cursor, sort="id"):
+        """ Read a cursor returned by get_page, raise ValueError if it is not valid """
+        if sort == "id":
+            return integer(cursor)
+        price, id = cursor.split("_")
+        return Product.price_bound(price), integer(id)
+
+    @classmethod
+    def get_page(cls, limit, schema, **filters):
+        """ Get a page of available products serialized by schema, filters are the arguments of get_available.
+            Return the products and the cursor of the next page, None if there are no more.
+        """
+        # Fetch one extra row to know if there is a next page without counting
+        products = schema.all(cls.get_available(**filters), limit = limit + 1)
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            next_cursor = last["id"] if filters.get("sort", "id") == "id" else f"{last['price']}_{last['id']}"
+        return products, next_cursor
+
+    @staticmethod
+    def valid_price(price):
+        """ Return the price as a Decimal rounded to the scale of the price column,
+            raise ValueError if it is not a number, is negative or doesn't fit the column
+        """
+        try:
+            price = Decimal(str(price))
+        except (InvalidOperation, ValueError):
+            raise ValueError("price debe ser un número")
+        column = Product.__table__.c.price.type
+        # is_finite() first, comparing NaN raises InvalidOperation
+        if not price.is_finite():
+            raise ValueError("price debe ser un número finito")
+        if price < 0:
+            raise ValueError("price no puede ser negativo")
+        limit = Decimal(10) ** (column.precision - column.scale)
+        if price >= limit or price.quantize(Decimal(1).scaleb(-column.scale)) >= limit:
+            raise ValueError(f"price debe ser menor que {limit}")
+        return price.quantize(Decimal(1).scaleb(-column.scale))
+
+    @staticmethod
+    def price_bound(value):
+        """ Return a price to compare the prices with as a Decimal, like the min_price of a filter,
+            raise ValueError if it is not a finite number of the magnitude of the price column
+        """
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            raise ValueError(value)
+        column = Product.__table__.c.price.type
+        if not price.is_finite() or abs(price) >= Decimal(10) ** (column.precision - column.scale):
+            raise ValueError(value)
+        return price
 
     def __repr__(self):
         """ Return a representancion of the instance """
@@ -231,7 +466,7 @@ class Product(db.Model, Crud):
             "id" : self.id,
             "name" : self.name,
             "description" : self.description,
-            "price" : self.price,
+            "price" : str(self.price),
             "amount_available" : self.amount_available,
             "active" : self.active,
             "category" : self.category.minialize(),
@@ -248,26 +483,133 @@ class Product(db.Model, Crud):
 
 class ProductToBuy(db.Model, Crud):
     id = db.Column(db.Integer, primary_key=True)
-    buyer_id = db.Column(db.Integer, db.ForeignKey('buyer.id'))
-    quantity = db.Column(db.String(10), nullable=False)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('buyer.id'), index=True)
+    quantity = db.Column(db.Integer, db.CheckConstraint("quantity > 0", name="ck_product_to_buy_quantity_positive"), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     
+    @classmethod
+    def load_options(cls):
+        return (joinedload(cls.product).joinedload(Product.category),)
+
     @classmethod
     def get_all_by_buyer_id(cls, buyer_id):
         """ Get all the products from a buyer id """
-        return cls.query.filter_by(buyer_id = buyer_id).all()
+        return cls.loaded_query().filter_by(buyer_id = buyer_id).all()
 
     @classmethod
-    def edit_quantity(cls, id, quantity):
-        """Edit a product quantity column  """
-        product = cls.get_by_id(id)
-        product.quantity = quantity
+    def edit_quantity(cls, id, quantity, buyer_id):
+        """Edit a product quantity column with a single UPDATE, return False if the product to buy doesn't exist
+           in the cart of the buyer
+        """
+        updated = cls.query.filter_by(id = id, buyer_id = buyer_id).update({"quantity": quantity}, synchronize_session=False)
         db.session.commit()
+        return updated == 1
 
-    def save(self):
-        """ Save and commit a new ProductToBuy """
-        db.session.add(self)
+    @classmethod
+    def delete_from_cart(cls, id, buyer_id):
+        """ Delete a product to buy of the cart of the buyer with a single DELETE, return False if it isn't there """
+        deleted = cls.query.filter_by(id = id, buyer_id = buyer_id).delete(synchronize_session=False)
         db.session.commit()
+        return deleted == 1
+
+    @classmethod
+    def apply_batch(cls, buyer_id, operations):
+        """ Apply a list of cart operations of a buyer in one transaction with bulk statements:
+                {"op": "add", "product_id": 4, "quantity": 1}
+                {"op": "update", "id": 7, "quantity": 3}
+                {"op": "delete", "id": 7}
+            Raise CartError, without changing anything, if any operation is not valid
+        """
+        to_add, to_update, to_delete = [], [], []
+        try:
+            for number, operation in enumerate(operations, start=1):
+                kind = operation.get("op")
+                if kind == "add":
+                    to_add.append({
+                        "buyer_id": buyer_id,
+                        "product_id": int(operation["product_id"]),
+                        "quantity": cls.valid_quantity(operation["quantity"])
+                    })
+                elif kind == "update":
+                    to_update.append({"id": int(operation["id"]), "quantity": cls.valid_quantity(operation["quantity"])})
+                elif kind == "delete":
+                    to_delete.append(int(operation["id"]))
+                else:
+                    raise CartError(f"Operación {number}: op debe ser add, update o delete")
+        except (KeyError, ValueError, TypeError, AttributeError):
+            raise CartError(f"Operación {number}: faltan campos o no son válidos")
+
+        product_ids = {line["product_id"] for line in to_add}
+        if product_ids:
+            found = {product_id for product_id, in db.session.query(Product.id).filter(Product.id.in_(product_ids))}
+            if found != product_ids:
+                raise CartError(f"Los productos {sorted(product_ids - found)} no existen")
+        line_ids = {line["id"] for line in to_update} | set(to_delete)
+        if line_ids:
+            found = {line_id for line_id, in db.session.query(cls.id).filter(cls.buyer_id == buyer_id, cls.id.in_(line_ids))}
+            if found != line_ids:
+                raise CartError(f"Los productos a comprar {sorted(line_ids - found)} no están en el carrito")
+
+        try:
+            if to_add:
+                db.session.bulk_insert_mappings(cls, to_add)
+            if to_update:
+                db.session.bulk_update_mappings(cls, to_update)
+            track_writes(db.session, cls.__tablename__)
+            if to_delete:
+                cls.query.filter(cls.buyer_id == buyer_id, cls.id.in_(to_delete)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def get_summary(cls, buyer_id):
+        """ Return the lines of the cart of the buyer with their totals, the subtotal per store and the total.
+            The lines are added up by the database in one aggregate query.
+        """
+        quantity = db.func.sum(cls.quantity)
+        lines = db.session.query(
+            Product.store_id, Product.id, Product.name, Product.price, quantity, quantity * Product.price
+        ).join(Product, cls.product_id == Product.id).filter(cls.buyer_id == buyer_id).group_by(
+            Product.store_id, Product.id, Product.name, Product.price
+        ).order_by(Product.store_id, Product.id)
+
+        summary = {"lines": [], "stores": [], "quantity": 0, "total": Decimal("0.00")}
+        store = None
+        for store_id, product_id, name, price, line_quantity, line_total in lines:
+            # Round like the Numeric(10, 2) columns, SQLite adds up in floating point
+            line_total = Decimal(line_total).quantize(Decimal("0.01"))
+            if store is None or store["store_id"] != store_id:
+                store = {"store_id": store_id, "quantity": 0, "subtotal": Decimal("0.00")}
+                summary["stores"].append(store)
+            summary["lines"].append({
+                "product_id": product_id, "name": name, "store_id": store_id,
+                "price": price, "quantity": line_quantity, "total": line_total
+            })
+            store["quantity"] += line_quantity
+            store["subtotal"] += line_total
+            summary["quantity"] += line_quantity
+            summary["total"] += line_total
+        return summary
+
+    @classmethod
+    def has_invalid_quantities(cls, buyer_id):
+        """ Return True if a line of the cart of the buyer has a quantity below one,
+            only possible in databases created without the CHECK of quantity
+        """
+        return db.session.query(cls.query.filter(cls.buyer_id == buyer_id, cls.quantity < 1).exists()).scalar()
+
+    @staticmethod
+    def valid_quantity(quantity):
+        """ Return the quantity as an integer, raise CartError if it is not a positive integer """
+        try:
+            quantity = integer(quantity)
+        except (ValueError, TypeError, OverflowError):
+            raise CartError("quantity debe ser un número entero")
+        if quantity < 1:
+            raise CartError("quantity debe ser mayor que cero")
+        return quantity
 
     def __repr__(self):
         """ Return a representancion of the instance """
@@ -281,4 +623,353 @@ class ProductToBuy(db.Model, Crud):
             "buyer_id": self.buyer_id,
             "quantity": self.quantity,
             "product" : self.product.serialize()
-        }
\ No newline at end of file
+        }
+
+class CartError(Exception):
+    pass
+
+class ReservationError(Exception):
+    pass
+
+class Order(db.Model, Crud):
+    """ A checked out cart, its lines keep the prices of the moment of the purchase """
+    id = db.Column(db.Integer, primary_key=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('buyer.id'), nullable=False, index=True)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lines = db.relationship('OrderLine', backref='order', lazy='selectin')
+
+    @classmethod
+    def create_from_cart(cls, buyer_id):
+        """ Create the order of the cart of the buyer without committing, its lines are copied by the database
+            with a single INSERT ... SELECT and its total added up from them
+        """
+        if ProductToBuy.has_invalid_quantities(buyer_id):
+            raise ReservationError("El carrito tiene cantidades menores que uno")
+        order = cls(buyer_id = buyer_id)
+        db.session.add(order)
+        db.session.flush()
+        quantity = db.func.sum(ProductToBuy.quantity)
+        cart = db.select([
+            db.literal(order.id), Product.id, Product.store_id, quantity, Product.price, quantity * Product.price
+        ]).select_from(
+            db.join(ProductToBuy, Product, ProductToBuy.product_id == Product.id)
+        ).where(ProductToBuy.buyer_id == buyer_id).group_by(Product.id, Product.store_id, Product.price)
+        lines = OrderLine.__table__
+        db.session.execute(lines.insert().from_select(
+            ["order_id", "product_id", "store_id", "quantity", "unit_price", "total"], cart
+        ))
+        total = db.select([db.func.coalesce(db.func.sum(lines.c.total), 0)]).where(lines.c.order_id == order.id).scalar_subquery()
+        cls.query.filter_by(id = order.id).update({"total": total}, synchronize_session=False)
+        db.session.expire(order)
+        return order
+
+    def __repr__(self):
+        """ Return a representancion of the instance """
+        return '<Order %r>' % self.id
+
+    def serialize(self):
+        """ Return a dictionary of the instance, with its lines and the subtotal per store """
+        stores = {}
+        for line in self.lines:
+            stores[line.store_id] = stores.get(line.store_id, 0) + line.total
+        return {
+            "id": self.id,
+            "buyer_id": self.buyer_id,
+            "total": str(self.total),
+            "created_at": self.created_at.isoformat(),
+            "stores": [ {"store_id": store_id, "subtotal": str(subtotal)} for store_id, subtotal in stores.items() ],
+            "lines": [ line.serialize() for line in self.lines ]
+        }
+
+class OrderLine(db.Model, Crud):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Numeric(10, 2), nullable=False)
+    total = db.Column(db.Numeric(12, 2), nullable=False)
+
+    def __repr__(self):
+        """ Return a representancion of the instance """
+        return '<OrderLine %r>' % self.id
+
+    def serialize(self):
+        """ Return a dictionary of the instance """
+        return {
+            "id": self.id,
+            "product_id": self.product_id,
+            "store_id": self.store_id,
+            "quantity": self.quantity,
+            "unit_price": str(self.unit_price),
+            "total": str(self.total)
+        }
+
+class Reservation(db.Model, Crud):
+    """ Stock of a product held for a buyer until it is checked out or it expires.
+        Every transaction changes its reservations first, in id order, and then the stock of the products, in
+        product id order, so two of them never wait for each other's rows (a deadlock).
+    """
+    __table_args__ = (
+        db.Index('ix_reservation_buyer_id_status', 'buyer_id', 'status'),
+        db.Index('ix_reservation_status_expires_at', 'status', 'expires_at'),
+    )
+    HELD = "held"
+    COMMITTED = "committed"
+    RELEASED = "released"
+
+    id = db.Column(db.Integer, primary_key=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('buyer.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=HELD)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def take_stock(cls, product_id, quantity):
+        """ Decrement the stock of a product in a single conditional UPDATE,
+            return False if there is not enough stock, so concurrent buyers can never oversell it
+        """
+        if quantity < 1:
+            # A negative quantity would add stock instead of taking it
+            raise ReservationError(f"La cantidad del producto {product_id} debe ser mayor que cero")
+        taken = Product.query.filter(
+            Product.id == product_id, Product.amount_available >= quantity
+        ).update(
+            {Product.amount_available: Product.amount_available - quantity}, synchronize_session=False
+        )
+        return taken == 1
+
+    @staticmethod
+    def add_stock(product_id, quantity):
+        """ Give back stock to a product """
+        Product.query.filter_by(id = product_id).update(
+            {Product.amount_available: Product.amount_available + quantity}, synchronize_session=False
+        )
+
+    @classmethod
+    def held_to_settle(cls, buyer_id, now):
+        """ Query of the held reservations that are expired or of the buyer, in id order """
+        return db.session.query(cls.id, cls.buyer_id, cls.product_id, cls.quantity, cls.expires_at).filter(
+            cls.status == cls.HELD, db.or_(cls.expires_at < now, cls.buyer_id == buyer_id)
+        ).order_by(cls.id)
+
+    @classmethod
+    def settle(cls, changes):
+        """ Change held reservations from a list of (id, status) in id order, without touching the stock.
+            Return the ids changed: only who changes a reservation from held gives its stock back, never twice
+        """
+        changed = set()
+        for reservation_id, status in sorted(changes):
+            if cls.query.filter_by(id = reservation_id, status = cls.HELD).update(
+                {"status": status}, synchronize_session=False
+            ) == 1:
+                changed.add(reservation_id)
+        return changed
+
+    @staticmethod
+    def returned_stock(reservations, changed):
+        """ Return product_id -> quantity of the reservations whose id is in changed """
+        returned = {}
+        for reservation in reservations:
+            if reservation.id in changed:
+                returned[reservation.product_id] = returned.get(reservation.product_id, 0) + reservation.quantity
+        return returned
+
+    @classmethod
+    def give_back(cls, returned):
+        """ Add the stock of product_id -> quantity to the products in id order """
+        for product_id, quantity in sorted(returned.items()):
+            cls.add_stock(product_id, quantity)
+
+    @classmethod
+    def reserve_cart(cls, buyer_id, ttl):
+        """ Hold the stock of every product in the cart of the buyer for ttl seconds, all or none of them.
+            The previous reservations of the buyer, and the expired ones of anybody, are given back first.
+        """
+        try:
+            now = datetime.utcnow()
+            previous = cls.held_to_settle(buyer_id, now).all()
+            changed = cls.settle([(reservation.id, cls.RELEASED) for reservation in previous])
+            returned = cls.returned_stock(previous, changed)
+            if ProductToBuy.has_invalid_quantities(buyer_id):
+                raise ReservationError("El carrito tiene cantidades menores que uno")
+            cart = cls.cart_quantities(buyer_id)
+            expires_at = now + timedelta(seconds=ttl)
+            reservations = []
+            # Every product in id order, see the lock order above
+            for product_id in sorted(returned.keys() | cart.keys()):
+                if product_id in returned:
+                    cls.add_stock(product_id, returned[product_id])
+                if product_id not in cart:
+                    continue
+                if not cls.take_stock(product_id, cart[product_id]):
+                    raise ReservationError(f"No hay suficiente stock del producto {product_id}")
+                reservations.append(cls(
+                    buyer_id = buyer_id, product_id = product_id, quantity = cart[product_id],
+                    status = cls.HELD, expires_at = expires_at
+                ))
+            if not reservations:
+                raise ReservationError("El carrito está vacío")
+            db.session.add_all(reservations)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return reservations
+
+    @classmethod
+    def cart_quantities(cls, buyer_id):
+        """ Return a dictionary product_id -> quantity of the cart of the buyer """
+        return dict(
+            db.session.query(ProductToBuy.product_id, db.func.sum(ProductToBuy.quantity))
+            .filter_by(buyer_id = buyer_id).group_by(ProductToBuy.product_id)
+        )
+
+    @classmethod
+    def checkout(cls, buyer_id):
+        """ Commit the held reservations of the buyer and turn its cart into an order, in one transaction.
+            The reservations must still be held and match the cart. Return the order.
+        """
+        try:
+            now = datetime.utcnow()
+            rows = cls.held_to_settle(buyer_id, now).all()
+            expired = [row for row in rows if row.expires_at < now]
+            own = [row for row in rows if row.buyer_id == buyer_id and row.expires_at >= now]
+            held = {}
+            for row in own:
+                held[row.product_id] = held.get(row.product_id, 0) + row.quantity
+            if not held or held != cls.cart_quantities(buyer_id):
+                raise ReservationError("Las reservas expiraron o el carrito cambió, hay que reservar de nuevo")
+            changed = cls.settle(
+                [(row.id, cls.RELEASED) for row in expired] + [(row.id, cls.COMMITTED) for row in own]
+            )
+            if any(row.id not in changed for row in own):
+                raise ReservationError("Las reservas expiraron o el carrito cambió, hay que reservar de nuevo")
+            cls.give_back(cls.returned_stock(expired, changed))
+            order = Order.create_from_cart(buyer_id)
+            ProductToBuy.query.filter_by(buyer_id = buyer_id).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return order
+
+    def __repr__(self):
+        """ Return a representancion of the instance """
+        return '<Reservation %r>' % self.id
+
+    def serialize(self):
+        """ Return a dictionary of the instance """
+        return {
+            "id" : self.id,
+            "buyer_id" : self.buyer_id,
+            "product_id" : self.product_id,
+            "quantity" : self.quantity,
+            "status" : self.status,
+            "expires_at" : self.expires_at.isoformat()
+        }
+
+
+class RevokedToken(db.Model, Crud):
+    """ A token logged out before it expired, kept until it expires """
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @classmethod
+    def revoke(cls, jti, expires_at):
+        """ Revoke the token and delete the rows of the tokens that expired by now """
+        cls.query.filter(cls.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        return cls.create(jti = jti, expires_at = expires_at).save()
+
+    @classmethod
+    def get_unexpired(cls):
+        """ Return (jti, expires_at) of the revoked tokens that didn't expire yet """
+        return db.session.query(cls.jti, cls.expires_at).filter(cls.expires_at > datetime.utcnow()).all()
+
+    def __repr__(self):
+        return '<RevokedToken %r>' % self.jti
+
+
+class TableVersion(db.Model):
+    """ Version of every table, bumped after each write, shared by all the workers through the database """
+    table_name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def bump(cls, *tablenames):
+        """ Increment the versions of the tables in their own short transaction, so the row locks are not held by the write """
+        table = cls.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                table.update().where(table.c.table_name.in_(tablenames)).values(version = table.c.version + 1, updated_at = now)
+            ).rowcount
+            if updated < len(set(tablenames)):
+                # Databases created before the versions existed get their rows on the first write
+                found = {name for name, in connection.execute(db.select([table.c.table_name]).where(table.c.table_name.in_(tablenames)))}
+                connection.execute(table.insert(), [
+                    {"table_name": name, "version": 1, "updated_at": now} for name in set(tablenames) - found
+                ])
+
+    @classmethod
+    def get_versions(cls, tablenames):
+        """ Return a dictionary table_name -> (version, updated_at) of the tables, in one query """
+        rows = db.session.query(cls.table_name, cls.version, cls.updated_at).filter(cls.table_name.in_(tablenames))
+        return {table_name: (version, updated_at) for table_name, version, updated_at in rows}
+
+
+@event.listens_for(TableVersion.__table__, "after_create")
+def create_table_versions(target, connection, **kw):
+    """ Start every table at version 0 so the writes only have to UPDATE their row """
+    now = datetime.utcnow()
+    connection.execute(target.insert(), [
+        {"table_name": name, "version": 0, "updated_at": now} for name in sorted(VERSIONED_TABLES)
+    ])
+
+
+@event.listens_for(Session, "after_flush")
+def track_flushed_tables(session, flush_context):
+    """ The tables of the objects the flush wrote, whoever flushed them (the endpoints, the admin, scripts) """
+    for instance in chain(session.new, session.dirty, session.deleted):
+        updated = instance in session.dirty
+        if updated and not session.is_modified(instance):
+            continue
+        state = inspect(instance)
+        track_writes(session, *(table.name for table in state.mapper.tables))
+        # The flush didn't clear the history yet
+        if isinstance(instance, Product) and (
+            not updated or any(state.attrs[name].history.has_changes() for name in PRODUCT_LISTING_COLUMNS)
+        ):
+            track_writes(session, PRODUCT_LISTING)
+
+def updated_columns(statement):
+    """ Names of the columns an UPDATE statement sets, None if they can't be told """
+    values = statement._ordered_values or (statement._values or {}).items()
+    if not values:
+        return None
+    return {getattr(column, "key", column) for column, _ in values}
+
+@event.listens_for(Session, "do_orm_execute")
+def track_executed_tables(orm_execute_state):
+    """ The tables of the INSERT, UPDATE and DELETE statements, like Query.update() and Query.delete() """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        statement = orm_execute_state.statement
+        track_writes(orm_execute_state.session, statement.table.name)
+        if statement.table.name == Product.__tablename__:
+            columns = updated_columns(statement) if orm_execute_state.is_update else None
+            if columns is None or columns & PRODUCT_LISTING_COLUMNS:
+                track_writes(orm_execute_state.session, PRODUCT_LISTING)
+
+@event.listens_for(Session, "after_commit")
+def bump_written_tables(session):
+    tablenames = session.info.pop("written_tables", None)
+    if tablenames:
+        invalidate_tables(*tablenames)
+
+@event.listens_for(Session, "after_rollback")
+def forget_written_tables(session):
+    session.info.pop("written_tables", None)
@@ -0,0 +1,49 @@
+"""
+Password hashing with a configurable method, run on a bounded pool of threads.
+
+PASSWORD_HASH_METHOD takes any method werkzeug understands, with its cost
+parameters. By default it is werkzeug's own "pbkdf2:sha256" with the cost of
+the installed werkzeug, the one the existing hashes were made with; a higher
+cost is a choice to make explicitly, e.g. "pbkdf2:sha256:600000". Hashes made
+with other parameters still verify and are upgraded on the next successful
+login, so changing it rehashes every password on its next login.
+
+hashlib releases the GIL while hashing, so with threaded workers the rest of
+the requests keep being served while a hash runs, and the pool size bounds how
+many cores logins can take from a worker.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from gevent.monkey import is_module_patched
+    if is_module_patched("threading"):
+        # Patched threads are greenlets, hash in real threads so the hub keeps serving requests
+        from gevent.threadpool import ThreadPoolExecutor
+except ImportError:
+    pass
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+@lru_cache(maxsize=None)
+def _method_prefix():
+    """ The method as werkzeug writes it in the hashes, with the default cost parameters filled in """
+    return generate_password_hash("", method=PASSWORD_HASH_METHOD).split("$", 1)[0] + "$"
+
+def hash_password(password):
+    """ Return the hash of password with the configured method """
+    return _pool.submit(generate_password_hash, password, method=PASSWORD_HASH_METHOD).result()
+
+def verify_password(hashed_password, password):
+    """ Check password against a hash made with any method """
+    return _pool.submit(check_password_hash, hashed_password, password).result()
+
+def needs_rehash(hashed_password):
+    """ Return True if the hash was not made with the configured method and cost """
+    return not hashed_password.startswith(_method_prefix())
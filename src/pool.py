@@ -0,0 +1,152 @@
+"""
+Configuration and instrumentation of the database connection pool.
+
+Every setting comes from the environment:
+    DB_POOL_SIZE: connections kept open per worker (default 5)
+    DB_MAX_OVERFLOW: extra connections opened when the pool is exhausted (default 10)
+    DB_POOL_TIMEOUT: seconds to wait for a connection before failing (default 30)
+    DB_POOL_RECYCLE: seconds before a connection is replaced, -1 to never replace them (default 1800)
+    DB_POOL_PRE_PING: test connections before using them, "true" or "false" (default true)
+    DB_STATEMENT_TIMEOUT_MS: cancel statements running longer than this, 0 to disable (default 0)
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+
+
+class PoolStats(object):
+    """ Counters of the connection pools of this process """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_seconds_max = 0.0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+            self.checkout_wait_seconds += waited
+            self.checkout_wait_seconds_max = max(self.checkout_wait_seconds_max, waited)
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool recording how long every checkout waits for a connection """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(Pool, "connect")
+def count_connect(dbapi_connection, connection_record):
+    pool_stats.count("connects")
+
+@event.listens_for(Pool, "close")
+def count_close(dbapi_connection, connection_record):
+    pool_stats.count("closes")
+
+@event.listens_for(Pool, "invalidate")
+def count_invalidation(dbapi_connection, connection_record, exception):
+    pool_stats.count("invalidations")
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+def engine_options(database_url):
+    """ Return the SQLALCHEMY_ENGINE_OPTIONS for the database """
+    options = {"pool_pre_ping": env_flag('DB_POOL_PRE_PING', "true")}
+    if database_url is None or database_url.startswith("sqlite"):
+        # SQLite connections are local files, Flask-SQLAlchemy picks their pool
+        return options
+    options.update(
+        poolclass = TimedQueuePool,
+        pool_size = int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        pool_recycle = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    )
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout and database_url.startswith("postgres"):
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+def set_mysql_statement_timeout(engine):
+    """ MySQL takes the timeout per session, set it on every new connection (it only applies to SELECT) """
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if not statement_timeout or engine.dialect.name != "mysql":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_timeout(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET SESSION max_execution_time = {statement_timeout}")
+        cursor.close()
+
+def pool_metrics(pool):
+    """ Return the metrics of the pool in the Prometheus text format """
+    lines = [
+        "# HELP db_pool_checkouts_total Connections checked out of the pool",
+        "# TYPE db_pool_checkouts_total counter",
+        f"db_pool_checkouts_total {pool_stats.checkouts}",
+        "# HELP db_pool_checkout_timeouts_total Checkouts that timed out waiting for a connection",
+        "# TYPE db_pool_checkout_timeouts_total counter",
+        f"db_pool_checkout_timeouts_total {pool_stats.checkout_timeouts}",
+        "# HELP db_pool_checkout_wait_seconds_total Time spent waiting for a connection",
+        "# TYPE db_pool_checkout_wait_seconds_total counter",
+        f"db_pool_checkout_wait_seconds_total {pool_stats.checkout_wait_seconds:.6f}",
+        "# HELP db_pool_checkout_wait_seconds_max Longest wait for a connection",
+        "# TYPE db_pool_checkout_wait_seconds_max gauge",
+        f"db_pool_checkout_wait_seconds_max {pool_stats.checkout_wait_seconds_max:.6f}",
+        "# HELP db_pool_connects_total Database connections opened",
+        "# TYPE db_pool_connects_total counter",
+        f"db_pool_connects_total {pool_stats.connects}",
+        "# HELP db_pool_closes_total Database connections closed",
+        "# TYPE db_pool_closes_total counter",
+        f"db_pool_closes_total {pool_stats.closes}",
+        "# HELP db_pool_invalidations_total Connections discarded after an error",
+        "# TYPE db_pool_invalidations_total counter",
+        f"db_pool_invalidations_total {pool_stats.invalidations}",
+    ]
+    if isinstance(pool, QueuePool):
+        lines += [
+            "# HELP db_pool_checked_out Connections in use",
+            "# TYPE db_pool_checked_out gauge",
+            f"db_pool_checked_out {pool.checkedout()}",
+            "# HELP db_pool_size Connections kept open by the pool",
+            "# TYPE db_pool_size gauge",
+            f"db_pool_size {pool.size()}",
+        ]
+    # A negative overflow means the pool opens as many connections as needed, it never saturates
+    if isinstance(pool, QueuePool) and pool._max_overflow >= 0:
+        capacity = pool.size() + pool._max_overflow
+        lines += [
+            "# HELP db_pool_saturation Connections in use over the most the pool can open",
+            "# TYPE db_pool_saturation gauge",
+            f"db_pool_saturation {pool.checkedout() / capacity if capacity > 0 else 0:.4f}",
+        ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,115 @@
+"""
+Full text search of the products by name and description, ranked by relevance.
+
+Every database uses its own full text index:
+    postgresql: a GIN index on the tsvector of name and description
+    sqlite: an FTS5 table kept in sync with product by triggers
+    mysql: a FULLTEXT index on name and description
+Any other database falls back to LIKE, without ranking.
+
+The indexes are created with the product table, or with `flask create-search-index`
+on an existing database.
+"""
+from sqlalchemy import event, text, literal, literal_column, table, column, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import joinedload
+from models import db, Product
+
+SEARCH_VECTOR_SQL = "to_tsvector('simple', product.name || ' ' || product.description)"
+
+SEARCH_INDEX_DDL = {
+    "postgresql": [
+        f"CREATE INDEX IF NOT EXISTS ix_product_search ON product USING GIN (({SEARCH_VECTOR_SQL}))",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(name, description, content='product', content_rowid='id')",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+            INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END""",
+        "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+    ],
+    "mysql": [
+        "CREATE FULLTEXT INDEX ix_product_search ON product (name, description)",
+    ],
+}
+
+product_fts = table("product_fts", column("rowid"), column("rank"))
+
+
+def create_search_index(connection):
+    """ Create the full text index of the products for the database of the connection """
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        exists = connection.execute(text("SHOW INDEX FROM product WHERE Key_name = 'ix_product_search'")).first()
+        if exists is not None:
+            return
+    for statement in SEARCH_INDEX_DDL.get(dialect, []):
+        connection.execute(text(statement))
+
+@event.listens_for(Product.__table__, "after_create")
+def create_search_index_with_table(target, connection, **kwargs):
+    create_search_index(connection)
+
+def fts5_query(terms):
+    """ Quote every term so the user input is never read as FTS5 syntax """
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+
+def match_products(query, terms):
+    """ Return the query filtered by the products matching the terms, and the expression of their rank """
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        vector = literal_column(SEARCH_VECTOR_SQL)
+        ts_query = db.func.plainto_tsquery("simple", terms)
+        return query.filter(vector.op("@@")(ts_query)), db.func.ts_rank(vector, ts_query)
+    if dialect == "sqlite":
+        # SQLite reads the matches from the FTS index first and then looks up their products. Joining the
+        # table itself makes it scan the active products and look each one up in the index instead, and
+        # so does a plain subquery, which it flattens into the join: OFFSET 0 keeps it a subquery.
+        matches = select(product_fts.c.rowid, product_fts.c.rank).where(
+            literal_column("product_fts").op("MATCH")(fts5_query(terms))
+        ).limit(literal_column("-1")).offset(literal_column("0")).subquery("matches")
+        query = query.join(matches, matches.c.rowid == Product.id)
+        # FTS5 ranks with bm25, the lower the better
+        return query, -matches.c.rank
+    if dialect == "mysql":
+        match = mysql.match(Product.name, Product.description, against=terms).in_natural_language_mode()
+        return query.filter(match), match
+    for term in terms.split():
+        pattern = f"%{term}%"
+        query = query.filter(db.or_(Product.name.ilike(pattern), Product.description.ilike(pattern)))
+    return query, literal(0)
+
+def search_products(terms, category_id=None, store_id=None, page=1, limit=20):
+    """ Search the available products by name and description, the most relevant first.
+        Return the page of products, if there is a next page, and the matches per category and per store
+    """
+    query = db.session.query(Product).filter(Product.active == True)
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
+    if store_id is not None:
+        query = query.filter(Product.store_id == store_id)
+    query, rank = match_products(query, terms)
+
+    # Fetch one extra row to know if there is a next page without counting
+    rows = query.options(joinedload(Product.category)).add_columns(rank.label("rank")).order_by(
+        rank.desc(), Product.id
+    ).offset((page - 1) * limit).limit(limit + 1).all()
+    # Both facets count the same matches, read them once and group them twice in one statement
+    candidates = query.with_entities(Product.category_id, Product.store_id).cte("candidates")
+    facet_counts = select(
+        literal("categories").label("facet"), candidates.c.category_id.label("facet_id"), db.func.count()
+    ).group_by(candidates.c.category_id).union_all(
+        select(literal("stores"), candidates.c.store_id, db.func.count()).group_by(candidates.c.store_id)
+    )
+    facets = {"categories": [], "stores": []}
+    for facet, facet_id, count in db.session.execute(facet_counts):
+        key = "category_id" if facet == "categories" else "store_id"
+        facets[facet].append({key: facet_id, "count": count})
+    return [product for product, _ in rows[:limit]], len(rows) > limit, facets
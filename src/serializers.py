@@ -0,0 +1,81 @@
+"""
+Schema-driven serializers for the read-only list endpoints.
+
+A Schema lists the columns of the dictionary a model serializes to. It selects
+only those columns, so the rows come back as plain tuples without building ORM
+objects, and it builds, once, a function turning a row into the dictionary.
+The dictionaries are the same the serialize() methods in models.py return.
+"""
+from operator import itemgetter
+from models import Buyer, Category, Product
+
+
+class Schema(object):
+    """ Fields of a serialized model, a field is a column or a nested Schema of a joined model """
+
+    def __init__(self, fields, joins=()):
+        self.fields = fields
+        self.joins = joins
+        self.columns = []
+        self.build = self._builder(fields)
+
+    def _builder(self, fields):
+        """ Return a function building the dictionary of fields from a row, adding their columns to self.columns """
+        names = tuple(name for name, _ in fields)
+        positions = []
+        nested = []
+        for name, field in fields:
+            # A nested schema takes the place of its first column, its id, None when the outer join found nothing
+            positions.append(len(self.columns))
+            if isinstance(field, Schema):
+                nested.append((name, len(self.columns), self._builder(field.fields)))
+            else:
+                self.columns.append(field)
+        # itemgetter of one index returns the value, not a tuple
+        values = itemgetter(*positions) if len(positions) > 1 else lambda row: (row[positions[0]],)
+
+        if not nested:
+            return lambda row: dict(zip(names, values(row)))
+
+        def build(row):
+            result = dict(zip(names, values(row)))
+            for name, first, build_nested in nested:
+                result[name] = build_nested(row) if row[first] is not None else None
+            return result
+        return build
+
+    def query(self, query):
+        """ Select only the columns of the schema from a query of the model """
+        for model, on in self.joins:
+            query = query.outerjoin(model, on)
+        return query.with_entities(*self.columns)
+
+    def all(self, query, limit=None):
+        """ Return the list of dictionaries of the rows of a query of the model """
+        query = self.query(query)
+        if limit is not None:
+            query = query.limit(limit)
+        build = self.build
+        return [build(row) for row in query]
+
+
+BUYER_SCHEMA = Schema((
+    ("id", Buyer.id),
+    ("id_number", Buyer.id_number),
+    ("first_name", Buyer.first_name),
+    ("last_name", Buyer.last_name),
+    ("cellphone_number", Buyer.cellphone_number),
+    ("address", Buyer.address),
+))
+
+PRODUCT_SCHEMA = Schema((
+    ("id", Product.id),
+    ("name", Product.name),
+    ("description", Product.description),
+    ("price", Product.price),
+    ("amount_available", Product.amount_available),
+    ("active", Product.active),
+    ("category", Schema((("id", Category.id), ("name", Category.name)))),
+    ("store_id", Product.store_id),
+    ("img_url", Product.img_url),
+), joins=((Category, Product.category_id == Category.id),))
@@ -0,0 +1,118 @@
+"""
+Conversion of an existing database to the typed price, stock and cart quantity columns.
+
+Databases created before product.price, product.amount_available and
+product_to_buy.quantity were numbers keep them as strings, and `flask db migrate`
+does not see type changes. `flask upgrade-typed-columns` converts the values in
+place (with USING casts on Postgres, a copy of the table on SQLite) and adds the
+CHECK constraints and indexes of the models the database is missing. It checks
+every value first and changes nothing if any of them is not a number the API
+would accept (see Product.valid_price), doesn't fit its column or breaks a
+constraint. On SQLite back up the file
+first, its driver commits every statement of the table copy as it runs.
+"""
+from decimal import InvalidOperation
+from sqlalchemy import inspect, select, table, column
+from models import db, Buyer, Seller, Store, Product, ProductToBuy, integer
+from search import create_search_index
+
+
+def positive_int(value):
+    """ Return the value as an integer, raise ValueError if it is below one or doesn't fit an Integer column """
+    if integer(value) < 1:
+        raise ValueError(value)
+    return int(value)
+
+# table -> (column, new type, Postgres cast of the old value, Python check of the old value)
+TYPED_COLUMNS = {
+    "product": [
+        # The prices the API accepts: finite, not negative and fitting Numeric(10, 2)
+        ("price", db.Numeric(10, 2), "price::numeric(10, 2)", Product.valid_price),
+        ("amount_available", db.Integer(), "amount_available::integer", integer),
+    ],
+    "product_to_buy": [
+        ("quantity", db.Integer(), "quantity::integer", positive_int),
+    ],
+}
+
+# table -> (name, condition, column, Python check of the values) of the CHECK constraints of the models
+CHECK_CONSTRAINTS = {
+    "product_to_buy": [
+        ("ck_product_to_buy_quantity_positive", "quantity > 0", "quantity", positive_int),
+    ],
+}
+
+INDEXED_MODELS = (Buyer, Seller, Store, Product, ProductToBuy)
+
+MAX_REPORTED_VALUES = 20
+
+
+class ConversionError(Exception):
+    pass
+
+
+def invalid_values(connection, tablename, name, check):
+    """ Return the (id, value) of the rows of the column the conversion would reject """
+    rows = table(tablename, column("id"), column(name))
+    invalid = []
+    for id, value in connection.execute(select([rows.c.id, rows.c[name]])):
+        try:
+            check(value.strip() if isinstance(value, str) else value)
+        except (ValueError, InvalidOperation, AttributeError):
+            invalid.append((id, value))
+            if len(invalid) >= MAX_REPORTED_VALUES:
+                break
+    return invalid
+
+def upgrade_typed_columns(connection):
+    """ Convert the string columns of TYPED_COLUMNS and create the missing CHECK constraints and indexes.
+        Return the converted columns and added constraints, raise ConversionError without changing anything
+        if a value is not a number or breaks a constraint.
+    """
+    inspector = inspect(connection)
+    pending, missing_checks = {}, {}
+    for tablename, columns in TYPED_COLUMNS.items():
+        current = {column["name"]: column["type"] for column in inspector.get_columns(tablename)}
+        pending[tablename] = [typed for typed in columns if isinstance(current[typed[0]], db.String)]
+    for tablename, checks in CHECK_CONSTRAINTS.items():
+        existing = {constraint["name"] for constraint in inspector.get_check_constraints(tablename)}
+        missing_checks[tablename] = [check for check in checks if check[0] not in existing]
+
+    errors = []
+    for tablename, columns in pending.items():
+        for name, _, _, check in columns:
+            errors += [f"{tablename}.{name} id {id}: {value!r}" for id, value in invalid_values(connection, tablename, name, check)]
+    for tablename, checks in missing_checks.items():
+        for constraint, condition, name, check in checks:
+            if any(typed[0] == name for typed in pending.get(tablename, ())):
+                # Already checked with the conversion
+                continue
+            errors += [f"{tablename}.{name} id {id}: {value!r} ({condition})" for id, value in invalid_values(connection, tablename, name, check)]
+    if errors:
+        raise ConversionError("Values that are not numbers or break a constraint, fix them and run it again:\n" + "\n".join(errors))
+
+    # Alembic is only imported when a conversion is needed, it is slow to import
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+    operations = Operations(MigrationContext.configure(connection))
+    converted = []
+    for tablename in TYPED_COLUMNS.keys() | CHECK_CONSTRAINTS.keys():
+        columns, checks = pending.get(tablename, []), missing_checks.get(tablename, [])
+        if not columns and not checks:
+            continue
+        # Every change of a table in one batch, SQLite copies the table once
+        with operations.batch_alter_table(tablename) as batch:
+            for name, type_, using, _ in columns:
+                batch.alter_column(name, type_=type_, existing_nullable=False, postgresql_using=using)
+                converted.append(f"{tablename}.{name}")
+            for constraint, condition, _, _ in checks:
+                batch.create_check_constraint(constraint, condition)
+                converted.append(f"{tablename} {constraint}")
+
+    for model in INDEXED_MODELS:
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    if pending["product"] and connection.dialect.name == "sqlite":
+        # The copy of the table dropped the triggers keeping the search index in sync
+        create_search_index(connection)
+    return converted
@@ -1,7 +1,55 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
+#
+# PRELOAD=true imports the app once in the gunicorn master before forking the workers (see gunicorn.conf.py).
+#
+# SERVING_MODE picks the gunicorn worker class (see the Procfile):
+#   sync: one request at a time per worker (default)
+#   gthread: THREADS requests at a time per worker
+#   gevent: WORKER_CONNECTIONS requests at a time per worker, every DB call yields to the other
+#           requests while it waits. Needs `pipenv install gevent psycogreen` and a larger DB_POOL_SIZE.
+import os
 
-from main import app as application
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+
+if SERVING_MODE == 'gevent':
+    # Patch the standard library before the app opens any socket
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        # psycopg2 is a C driver, it needs its own patch to wait cooperatively
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def create_app():
+    """ Import and return the application.
+        With `gunicorn --preload` (PRELOAD=true, see gunicorn.conf.py) the master runs it once and the
+        workers share the imported code and data copy-on-write, instead of every worker importing it on boot.
+        The category index is built here too, so no request waits for it.
+    """
+    from main import app
+    from category_index import category_index
+    with app.app_context():
+        category_index.build()
+    return app
+
+def after_fork(app):
+    """ Run in every worker forked from a preloaded master """
+    from models import db
+    with app.app_context():
+        # Connections opened by the master can't be shared between processes, every worker opens its own.
+        # close=False leaves the master's connections alone: closing them here would end the sessions
+        # the master and the other workers still see through the same sockets.
+        try:
+            db.engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy before 1.4.33 has no close argument, replace the pool the same way it does
+            db.engine.pool = db.engine.pool.recreate()
+
+application = create_app()
 
 if __name__ == "__main__":
     application.run()
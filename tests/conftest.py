@@ -0,0 +1,61 @@
+"""
+Fixtures of the API tests: the app on a seeded SQLite database in a temporary
+directory, with the response cache disabled so every request runs its queries.
+
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+# Read when main is imported
+os.environ["DB_CONNECTION_STRING"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.sqlite")
+os.environ["CACHE_TTL"] = "0"
+# The revoked tokens are only read on the first request, not in the middle of a test
+os.environ["REVOCATION_SYNC_SECONDS"] = "3600"
+
+VOLUMES = {"users": 40, "categories": 5, "products": 400, "cart_rows": 200}
+
+
+@pytest.fixture(scope="session")
+def app():
+    from main import app
+    from seed import seed
+    with app.app_context():
+        app.config["COUNTS"] = seed(VOLUMES)
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def count_queries(app):
+    """ Return a function running a request and returning (response, number of SQL statements it ran),
+        the statements of the last request are in its statements attribute
+    """
+    from sqlalchemy import event
+    from models import db
+    with app.app_context():
+        engine = db.engine
+    queries = []
+
+    def count(*args):
+        queries.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", count)
+
+    def run(request):
+        del queries[:]
+        response = request()
+        response.get_data()
+        return response, len(queries)
+
+    run.statements = queries
+    yield run
+    event.remove(engine, "before_cursor_execute", count)
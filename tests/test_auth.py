@@ -0,0 +1,58 @@
+"""
+The protected routes answer 401 without a valid token and 403 to a user acting
+on the cart or the store of somebody else.
+"""
+from flask_jwt_extended import create_access_token
+
+NEW_PRODUCT = {
+    "name": "Producto", "description": "Descripción", "price": "10.00", "amount_available": 5,
+    "active": True, "img_url": "", "category_id": 1
+}
+
+
+def token_headers(app, user_id):
+    with app.app_context():
+        token = create_access_token(identity=str(user_id))
+    return {"Authorization": f"Bearer {token}"}
+
+def buyer_headers(app, buyer_id):
+    # The seed makes the sellers users 1 to sellers and the buyers the users after them
+    return token_headers(app, app.config["COUNTS"]["sellers"] + buyer_id)
+
+def login(client, user_id):
+    response = client.post("/login", json={"email": f"user{user_id}@bench.test", "password": "password"})
+    assert response.status_code == 201
+    return {"Authorization": f"Bearer {response.json['jwt']}"}
+
+def test_missing_token(client):
+    assert client.get("/1/cart").status_code == 401
+    assert client.post("/stores/1/new-product", json=NEW_PRODUCT).status_code == 401
+    assert client.post("/logout").status_code == 401
+
+def test_invalid_token(client):
+    assert client.get("/1/cart", headers={"Authorization": "Bearer not-a-token"}).status_code == 401
+
+def test_cart_of_another_buyer(app, client):
+    headers = buyer_headers(app, 1)
+    assert client.get("/1/cart", headers=headers).status_code == 200
+    response = client.get("/2/cart", headers=headers)
+    assert response.status_code == 403
+    assert response.json["message"] == "No tiene permiso sobre este carrito"
+    assert client.post("/2/reserve", headers=headers).status_code == 403
+
+def test_store_of_another_seller(app, client):
+    headers = token_headers(app, 1)
+    response = client.post("/stores/2/new-product", headers=headers, json=NEW_PRODUCT)
+    assert response.status_code == 403
+    assert response.json["message"] == "No tiene permiso sobre esta tienda"
+    # A buyer is no seller of any store
+    assert client.post("/stores/1/new-product", headers=buyer_headers(app, 1), json=NEW_PRODUCT).status_code == 403
+
+def test_revoked_token(app, client):
+    headers = login(client, app.config["COUNTS"]["sellers"] + 3)
+    assert client.get("/3/cart", headers=headers).status_code == 200
+    assert client.post("/logout", headers=headers).status_code == 200
+    response = client.get("/3/cart", headers=headers)
+    assert response.status_code == 401
+    assert response.json["msg"] == "El token fue revocado"
+    assert client.post("/logout", headers=headers).status_code == 401
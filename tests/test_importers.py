@@ -0,0 +1,24 @@
+"""
+The rows of an import are checked like the products created one by one, the
+invalid ones are reported and the rest imported.
+"""
+import json
+from flask_jwt_extended import create_access_token
+
+
+def test_ndjson_amount_available_must_be_whole(app, client):
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity='1')}"}
+    product = {
+        "name": "Producto", "description": "Descripción", "price": "10.00",
+        "img_url": "https://example.com/p.png", "category_id": 1
+    }
+    amounts = [1.7, 2, 3.0, "4", True, 2 ** 31]
+    body = "\n".join(json.dumps(dict(product, amount_available=amount)) for amount in amounts)
+    response = client.post(
+        "/stores/1/import-products", headers=headers, data=body, content_type="application/x-ndjson"
+    )
+    assert response.status_code == 200
+    report = response.json["report"]
+    assert report["imported"] == 3
+    assert [error["row"] for error in report["errors"]] == [1, 5, 6]
@@ -0,0 +1,118 @@
+"""
+Every list endpoint runs a fixed number of SQL statements, whatever the number
+of rows it returns, so a serializer loading a relationship per row shows up here.
+"""
+from flask_jwt_extended import create_access_token
+from models import db, Product, TableVersion
+
+
+def bump(app, *tablenames):
+    """ Make the in-process indexes built from the tables reload on the next request """
+    with app.app_context():
+        TableVersion.bump(*tablenames)
+
+def buyer_headers(app, buyer_id):
+    counts = app.config["COUNTS"]
+    with app.app_context():
+        token = create_access_token(identity=str(counts["sellers"] + buyer_id))
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_buyers(client, count_queries):
+    response, queries = count_queries(lambda: client.get("/buyers"))
+    assert response.status_code == 200
+    assert len(response.json["buyers"]) == 20
+    # The buyers
+    assert queries == 1
+
+def test_stores(client, count_queries):
+    response, queries = count_queries(lambda: client.get("/stores"))
+    assert response.status_code == 200
+    assert len(response.json["stores"]) == 20
+    # The table versions, the product summaries of every store and the stores
+    assert queries == 3
+
+def test_stores_streamed(client, count_queries):
+    response, queries = count_queries(lambda: client.get("/stores?stream=true"))
+    assert response.status_code == 200
+    assert response.json["stores"] == client.get("/stores").json["stores"]
+    # The table versions, the stores and their summaries per batch, and the empty batch at the end
+    assert queries == 4
+
+def test_categories(app, client, count_queries):
+    bump(app, "category")
+    response, queries = count_queries(lambda: client.get("/categories"))
+    assert response.status_code == 200
+    assert sum(category["product_count"] for category in response.json["categories"]) > 0
+    # The table versions and the category index (its product counts and category names), reloaded because the categories changed
+    assert queries == 3
+    response, queries = count_queries(lambda: client.get("/categories"))
+    # The table versions only
+    assert queries == 1
+
+def test_categories_after_stock_changes(app, client, count_queries):
+    client.get("/categories")
+    with app.app_context():
+        Product.query.filter_by(id = 1).update({Product.amount_available: Product.amount_available - 1})
+        db.session.commit()
+    response, queries = count_queries(lambda: client.get("/categories"))
+    # The table versions only, the stock is not in the category index
+    assert queries == 1
+    before = sum(category["product_count"] for category in response.json["categories"])
+    with app.app_context():
+        product = Product.query.filter_by(active = True).first()
+        product.active = False
+        product_id = product.id
+        db.session.commit()
+    response, queries = count_queries(lambda: client.get("/categories"))
+    # The table versions and the category index, reloaded because a product was deactivated
+    assert queries == 3
+    assert sum(category["product_count"] for category in response.json["categories"]) == before - 1
+    with app.app_context():
+        Product.query.filter_by(id = product_id).update({"active": True})
+        db.session.commit()
+    response, queries = count_queries(lambda: client.get("/categories"))
+    assert sum(category["product_count"] for category in response.json["categories"]) == before
+
+def test_categories_with_products(app, client, count_queries):
+    bump(app, "category")
+    response, queries = count_queries(lambda: client.get("/categories?include=products&limit=5"))
+    assert response.status_code == 200
+    assert all(len(category["products"]) == 5 for category in response.json["categories"])
+    # The table versions, the first products of every category and the category index
+    assert queries == 4
+
+def test_products(client, count_queries):
+    response, queries = count_queries(lambda: client.get("/products?limit=100"))
+    assert response.status_code == 200
+    assert len(response.json["products"]) == 100
+    # The table versions and the page of products with their categories
+    assert queries == 2
+
+def test_search(client, count_queries):
+    response, queries = count_queries(lambda: client.get("/products/search?q=coffee"))
+    assert response.status_code == 200
+    facets = response.json["facets"]
+    assert sum(facet["count"] for facet in facets["categories"]) == sum(facet["count"] for facet in facets["stores"]) > 0
+    # The page of products with their categories and both facets
+    assert queries == 2
+
+def test_products_to_buy(app, client, count_queries):
+    headers = buyer_headers(app, 1)
+    # Resolves the user of the token and loads the revoked tokens, once
+    client.get("/1/cart", headers=headers)
+    response, queries = count_queries(lambda: client.get("/1/products-to-buy", headers=headers))
+    assert response.status_code == 200
+    assert len(response.json["products_to_buy"]) > 1
+    # The products to buy with their products and categories
+    assert queries == 1
+
+def test_cart_writes_bump_no_versions(app, client, count_queries):
+    headers = buyer_headers(app, 1)
+    client.get("/1/cart", headers=headers)
+    response, queries = count_queries(lambda: client.post(
+        "/add-product", json={"product_id": 1, "quantity": 1}, headers=headers
+    ))
+    assert response.status_code == 201
+    # Nothing reads the version of the carts, the commit is the only transaction
+    assert not any("table_version" in statement for statement in count_queries.statements)
@@ -0,0 +1,33 @@
+"""
+Query string params that can't be read, or that no row could match, are answered
+with a 400 before reaching the database.
+"""
+import pytest
+
+
+@pytest.mark.parametrize("query", [
+    "cursor=99999999999999999999999",
+    "cursor=abc",
+    "category_id=99999999999999999999",
+    "store_id=1e3",
+    "min_price=NaN",
+    "min_price=Infinity",
+    "max_price=-inf",
+    "max_price=1e20",
+    "sort=price&cursor=NaN_3",
+    "sort=price&cursor=10.00_99999999999999999999",
+    "sort=-price&cursor=10.00",
+])
+def test_invalid_products_params(client, query):
+    response = client.get("/products?" + query)
+    assert response.status_code == 400
+    assert "no es válido" in response.get_json()["message"]
+
+def test_products_price_range(client):
+    response = client.get("/products?min_price=0&max_price=99999999.99&sort=price")
+    assert response.status_code == 200
+    assert response.get_json()["products"]
+
+@pytest.mark.parametrize("query", ["page=99999999999999999999", "category_id=99999999999999999999"])
+def test_invalid_search_params(client, query):
+    assert client.get("/products/search?q=a&" + query).status_code == 400